@@ -0,0 +1,57 @@
+from src.predictor import vTrain
+from src.config import vTrainConfig
+
+import os
+import time
+import logging
+
+import argparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def main(args):
+    config_files = sorted(f for f in os.listdir(args.config_dir) if f.endswith(".json"))
+
+    worst = 0.
+    for config_file in config_files:
+        config = vTrainConfig.load_from_file(os.path.join(args.config_dir, config_file))
+        periods = args.periods or config.pipeline_parallel_size
+        if config.pipeline_scheduling != "1f1b":
+            continue
+        config.steady_state_periods = periods
+        sim = vTrain(config)
+        num_microbatch = sim.get_num_microbatch()
+        if not sim.use_extrapolation():
+            continue
+        kernel_dict = sim.profile()
+
+        logger.setLevel(logging.WARNING)
+        start = time.perf_counter()
+        result, _ = sim.simulate(kernel_dict, engine=args.engine)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        extrapolated, _ = sim.extrapolate(kernel_dict, periods, engine=args.engine)
+        extrapolated_time = time.perf_counter() - start
+        logger.setLevel(logging.INFO)
+
+        iter_time = max(result.values())
+        error = abs(max(extrapolated.values()) - iter_time) / iter_time
+        worst = max(worst, error)
+        logger.info(f"{config_file}: {num_microbatch} microbatches, "
+                    f"error {error*100:.4f}%, {full_time:.2f}s -> {extrapolated_time:.2f}s")
+
+    logger.info(f"worst extrapolation error: {worst*100:.4f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config_dir", type=str, default="config/validation/multi")
+    parser.add_argument("--periods", type=int, default=None,
+                        help="steady-state periods, at least pipeline_parallel_size of each config (the default)")
+    parser.add_argument("--engine", type=str, default="event")
+    args = parser.parse_args()
+
+    main(args)
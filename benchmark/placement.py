@@ -0,0 +1,35 @@
+from src.predictor import vTrain
+from src.config import vTrainConfig
+
+import time
+import logging
+
+import argparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def main(args):
+    config = vTrainConfig.load_from_file(args.config)
+    sim = vTrain(config)
+
+    logger.setLevel(logging.WARNING)
+    start = time.perf_counter()
+    ranking = sim.search_placement(args.orders)
+    elapsed = time.perf_counter() - start
+    logger.setLevel(logging.INFO)
+
+    for iter_time, order in ranking:
+        logger.info(f"{order}: {iter_time/1000/1000:.3f} ms")
+    logger.info(f"best placement {ranking[0][1]}, searched {len(ranking)} placements in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c, --config", type=str, dest="config",
+                        default="config/validation/multi/config_val_175B_2_8_32_2.json")
+    parser.add_argument("--orders", type=str, nargs="+", default=None)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,63 @@
+from src.predictor import vTrain
+from src.config import vTrainConfig
+from src.planner import candidates, search_layouts, layout_of
+
+import copy
+import time
+import logging
+
+import argparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def main(args):
+    config = vTrainConfig.load_from_file(args.config)
+    num_gpus = args.num_gpus or config.num_gpus
+
+    # an extrapolation setting shared by all layouts must not drop deep pipelines
+    layouts = {layout_of(candidate) for candidate in candidates(config, num_gpus, args.micro_batch_sizes)}
+    extrapolated = copy.copy(config)
+    extrapolated.steady_state_periods = args.steady_state_periods
+    assert {layout_of(candidate) for candidate in candidates(extrapolated, num_gpus, args.micro_batch_sizes)} == layouts
+    max_pp = max(candidate.pipeline_parallel_size for candidate in candidates(extrapolated, num_gpus, args.micro_batch_sizes))
+    logger.info(f"{len(layouts)} layouts up to pp={max_pp} with steady_state_periods={args.steady_state_periods}")
+
+    logger.setLevel(logging.WARNING)
+    start = time.perf_counter()
+    ranking, stats = search_layouts(config, num_gpus, args.micro_batch_sizes, args.top_k, args.engine)
+    search_time = time.perf_counter() - start
+
+    # brute force: simulate every layout
+    start = time.perf_counter()
+    expected = []
+    for candidate in candidates(config, num_gpus, args.micro_batch_sizes):
+        sim = vTrain(candidate)
+        if not sim.fits_in_memory():
+            continue
+        result, _ = sim(engine=args.engine)
+        expected.append((max(result.values()), layout_of(candidate)))
+    expected.sort()
+    brute_force_time = time.perf_counter() - start
+    logger.setLevel(logging.INFO)
+
+    # layouts may tie, their iteration times may not differ
+    assert [iteration_time for iteration_time, _ in ranking] == \
+        [iteration_time for iteration_time, _ in expected[:args.top_k]]
+    logger.info(f"top {args.top_k} of {stats['candidates']} layouts: {stats['simulated']} simulated, "
+                f"{search_time:.2f}s (brute force {brute_force_time:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c, --config", type=str, dest="config",
+                        default="config/validation/multi/config_val_39B_8_8_8_3.json")
+    parser.add_argument("--num_gpus", type=int, default=None)
+    parser.add_argument("--micro_batch_sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--top_k", type=int, default=3)
+    parser.add_argument("--steady_state_periods", type=int, default=2)
+    parser.add_argument("--engine", type=str, default="numpy")
+    args = parser.parse_args()
+
+    main(args)
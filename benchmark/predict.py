@@ -0,0 +1,66 @@
+from src.predictor import vTrain
+from src.config import vTrainConfig
+from src.graph import DepGraph
+
+import os
+import time
+import logging
+
+import argparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def run_engine(sim, kernel_dict, engine):
+    sim.graph = DepGraph()
+    sim.create_layer_graph(sim.create_nodes())
+
+    start = time.perf_counter()
+    result, breakdown = sim.predict(kernel_dict, engine=engine)
+    elapsed = time.perf_counter() - start
+
+    return result, breakdown, elapsed
+
+
+def max_difference(result, breakdown, ref_result, ref_breakdown):
+    diff = [abs(result[s] - ref_result[s]) for s in ref_result]
+    diff += [abs(breakdown[s][k] - ref_breakdown[s][k]) for s in ref_breakdown for k in ref_breakdown[s]]
+    return max(diff, default=0.)
+
+
+def main(args):
+    config_files = sorted(f for f in os.listdir(args.config_dir) if f.endswith(".json"))
+
+    total = {engine: 0. for engine in args.engines}
+    for config_file in config_files:
+        config = vTrainConfig.load_from_file(os.path.join(args.config_dir, config_file))
+        sim = vTrain(config)
+        kernel_dict = sim.profile()
+
+        logger.setLevel(logging.WARNING)
+        results = {engine: run_engine(sim, kernel_dict, engine) for engine in args.engines}
+        logger.setLevel(logging.INFO)
+
+        ref_result, ref_breakdown, _ = results[args.engines[0]]
+        for engine, (result, breakdown, elapsed) in results.items():
+            diff = max_difference(result, breakdown, ref_result, ref_breakdown)
+            if diff >= 1:   # nanosecond
+                logger.error(f"{config_file}: '{engine}' differs from '{args.engines[0]}' by {diff:.1f} ns")
+            total[engine] += elapsed
+
+        times = ", ".join(f"{engine}={elapsed:.3f}s" for engine, (_, _, elapsed) in results.items())
+        logger.info(f"{config_file}: {times}")
+
+    base = total[args.engines[0]]
+    for engine, elapsed in total.items():
+        logger.info(f"[{engine}] total {elapsed:.3f}s (speedup x{base / elapsed:.2f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config_dir", type=str, default="config/validation/multi")
+    parser.add_argument("--engines", type=str, nargs="+", default=["reference", "event", "compact", "numpy"])
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,50 @@
+from src.predictor import vTrain
+from src.config import vTrainConfig
+from src.schedule import pipeline_schedules
+
+import logging
+
+import argparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def main(args):
+    for scheduling in args.schedules:
+        virtual_sizes = args.virtual_pipeline_sizes if scheduling == "interleaved" else [1]
+        for virtual_pipeline_size in virtual_sizes:
+            config = vTrainConfig.load_from_file(args.config)
+            config.pipeline_scheduling = scheduling
+            config.virtual_pipeline_size = virtual_pipeline_size
+            try:
+                config.validate_config()
+            except AssertionError as e:
+                logger.warning(f"{scheduling} (v={virtual_pipeline_size}): {e}")
+                continue
+
+            sim = vTrain(config)
+            logger.setLevel(logging.WARNING)
+            try:
+                result, _ = sim(engine=args.engine)
+            except ValueError as e:
+                logger.setLevel(logging.INFO)
+                logger.warning(f"{scheduling}: {e}")
+                continue
+            logger.setLevel(logging.INFO)
+
+            name = f"{scheduling} (v={virtual_pipeline_size})" if scheduling == "interleaved" else scheduling
+            logger.info(f"{name}: {max(result.values())/1000/1000:.3f} ms, "
+                        f"bubble fraction {sim.bubble_fraction:.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c, --config", type=str, dest="config",
+                        default="config/validation/multi/config_val_175B_8_8_8_2.json")
+    parser.add_argument("--schedules", type=str, nargs="+", default=list(pipeline_schedules.keys()))
+    parser.add_argument("--virtual_pipeline_sizes", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--engine", type=str, default="numpy")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,57 @@
+from src.predictor import vTrain
+from src.config import vTrainConfig
+
+import time
+import logging
+import resource
+import multiprocessing
+
+import argparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def run_engine(args, engine, queue):
+    config = vTrainConfig.load_from_file(args.config)
+    # keep the parallelism of the config, scale the batch to the microbatch count
+    config.global_batch_size = args.num_microbatch * config.data_parallel_size * config.micro_batch_size
+    sim = vTrain(config)
+    kernel_dict = sim.profile()
+
+    logger.setLevel(logging.WARNING)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    result, _ = sim.simulate(kernel_dict, engine=engine)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    queue.put((max(result.values()), elapsed, base_rss, peak_rss, sim.get_num_microbatch()))
+
+
+def main(args):
+    # every engine runs in a fresh process so that peak RSS is not shared
+    ctx = multiprocessing.get_context("spawn")
+    ref = None
+    for engine in args.engines:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_engine, args=(args, engine, queue))
+        proc.start()
+        iter_time, elapsed, base_rss, peak_rss, num_microbatch = queue.get()
+        proc.join()
+
+        if ref is None:
+            ref = iter_time
+        logger.info(f"{engine}: {num_microbatch} microbatches, {elapsed:.2f}s, "
+                    f"peak RSS {peak_rss/1024:.1f} MB (+{(peak_rss-base_rss)/1024:.1f} MB while simulating), "
+                    f"diff {abs(iter_time-ref):.1f} ns")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="config/validation/multi/config_val_175B_2_8_32_2.json")
+    parser.add_argument("--num_microbatch", type=int, default=1920)
+    parser.add_argument("--engines", type=str, nargs="+", default=["event", "numpy", "streaming"])
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,73 @@
+from src.trace_parser import parse_trace, parse_trace_file
+
+import os
+import time
+import random
+import logging
+import tempfile
+
+import argparse
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format="[%(asctime)s] (%(levelname)s) %(message)s",
+    datefmt="%m/%d/%Y %H:%M:%S",
+    level=logging.INFO
+)
+
+
+def write_trace(filename, num_records, seed=0):
+    # synthetic trace of transformer layers, ~2 records (launch + kernel) per kernel
+    rng = random.Random(seed)
+    t, cid, layer = 0, 0, 0
+    records = 0
+    with open(filename, "w") as f:
+        while records < num_records:
+            for phase in ["forward", "backward", "WU"]:
+                t += 10
+                f.write(f'{t},0,TIMESTAMP,0,"{phase} start transformer {layer}"\n')
+                for k in range(rng.randint(3, 12)):
+                    cid += 1
+                    t += rng.randint(100, 3000)
+                    f.write(f"{t},500,RUNTIME,cudaLaunchKernel_v7000,{cid}\n")
+                    t += rng.randint(10, 500)
+                    duration = rng.randint(1000, 90000)
+                    f.write(f'{t},{duration},KERNEL,"ampere_fp16_s1688gemm_fp16_{k}_tn",0,7,{cid}\n')
+                    t += duration
+                    records += 2
+                t += 10
+                f.write(f'{t},0,TIMESTAMP,0,"{phase} end transformer {layer}"\n')
+                records += 2
+            layer += 1
+    return records
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "trace")
+        num_records = write_trace(filename, args.num_records)
+        logger.info(f"{num_records} records, {os.path.getsize(filename)/1024**2:.1f} MB")
+
+        start = time.perf_counter()
+        with open(filename, "r") as f:
+            expected = parse_trace(f.readlines())
+        elapsed = time.perf_counter() - start
+        logger.info(f"readlines: {elapsed:.2f}s, {num_records/elapsed:.0f} records/s")
+
+        for num_workers in args.workers:
+            start = time.perf_counter()
+            kernel_dict = parse_trace_file(filename, num_workers, args.chunk_size * 1024 ** 2)
+            elapsed = time.perf_counter() - start
+            assert kernel_dict == expected
+            logger.info(f"{num_workers} workers: {elapsed:.2f}s, {num_records/elapsed:.0f} records/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_records", type=int, default=2000000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunk_size", type=int, default=16,
+                        help="MB of trace per chunk")
+    args = parser.parse_args()
+
+    main(args)
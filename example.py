@@ -1,5 +1,6 @@
 from src.predictor import vTrain
 from src.config import vTrainConfig
+from src.result_store import ResultStore
 
 import logging
 
@@ -11,16 +12,23 @@ logger.setLevel(logging.INFO)
 def main(args):
     config = vTrainConfig.load_from_file(args.config)
 
-    sim = vTrain(config)
+    result_store = ResultStore(args.store) if args.store is not None else None
+    sim = vTrain(config, result_store=result_store)
 
-    result, breakdown = sim()
+    result, breakdown = sim(engine=args.engine)
     pred_iter_time = max(result.values())/1000/1000
     
     logger.info(f"predicted iteration time: {pred_iter_time:.3f} ms")
+    logger.info(f"pipeline bubble fraction ({config.pipeline_scheduling}): {sim.bubble_fraction:.4f}")
+    logger.info(f"estimated peak memory per GPU: {sim.get_peak_memory() / (2 ** 30):.1f} GB")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-c, --config", type=str, dest="config")
+    parser.add_argument("--engine", type=str, default="event",
+                        choices=["event", "reference", "compact", "numpy", "streaming"])
+    parser.add_argument("--store", type=str, default=None,
+                        help="SQLite result store, reused if the config was predicted before")
     args = parser.parse_args()
 
     main(args)
\ No newline at end of file
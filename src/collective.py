@@ -0,0 +1,178 @@
+import numpy as np
+
+import os
+import threading
+
+
+class AllreduceLUT():
+    '''
+        measured allreduce times of one GPU count as sorted arrays
+        sizes within the measured range are interpolated in log-log space,
+            sizes beyond it are extrapolated with an alpha-beta model
+            (t = alpha + size / beta) fitted to the ``num_fit`` measurements
+            at that end and anchored at the last one, so that t is continuous
+    '''
+    def __init__(self, sizes, times, num_fit=8):
+        order = np.argsort(sizes)
+        self.sizes = np.asarray(sizes, dtype=np.float64)[order]     # bytes
+        self.times = np.asarray(times, dtype=np.float64)[order]     # ns
+        self.log_sizes = np.log(self.sizes)
+        self.log_times = np.log(self.times)
+
+        # (alpha in ns, 1/beta in ns per byte) of either end
+        self.low = self.fit(self.sizes[:num_fit], self.times[:num_fit], self.sizes[0], self.times[0])
+        self.high = self.fit(self.sizes[-num_fit:], self.times[-num_fit:], self.sizes[-1], self.times[-1])
+
+    @staticmethod
+    def fit(sizes, times, anchor_size, anchor_time):
+        slope = np.polyfit(sizes, times, 1)[0] if len(sizes) > 1 else 0.
+        # non-negative latency and transfer time
+        slope = min(max(slope, 0.), anchor_time / anchor_size)
+        return anchor_time - slope * anchor_size, slope
+
+    def __call__(self, sizes):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        t = np.exp(np.interp(np.log(np.clip(sizes, self.sizes[0], self.sizes[-1])),
+                             self.log_sizes, self.log_times))
+        t = np.where(sizes < self.sizes[0], self.low[0] + sizes * self.low[1], t)
+        t = np.where(sizes > self.sizes[-1], self.high[0] + sizes * self.high[1], t)
+        return t
+
+    @classmethod
+    def load(cls, filename):
+        # nccl-tests output: size(B),count,type,time(ns),busbw(GB/s),time(ns),busbw(GB/s)
+        data = np.loadtxt(filename, delimiter=",", skiprows=1, usecols=(0, 5), ndmin=2)
+        return cls(data[:, 0], data[:, 1])
+
+
+# allreduce LUTs of every trace directory, parsed once per process
+_allreduce_LUTs = dict()
+_allreduce_LUTs_lock = threading.Lock()
+
+
+def load_allreduce_LUTs(base_dir):
+    '''
+        {num_gpus: AllreduceLUT} of the ``AR_GPU{num_gpus}_*_LUT`` files in ``base_dir``
+    '''
+    key = os.path.abspath(base_dir)
+    with _allreduce_LUTs_lock:
+        if key not in _allreduce_LUTs:
+            luts = dict()
+            for filename in sorted(os.listdir(key)):
+                if not filename.endswith("_LUT"):
+                    continue
+                num_gpus = int(filename.split("_")[1][3:])
+                luts[num_gpus] = AllreduceLUT.load(os.path.join(key, filename))
+            _allreduce_LUTs[key] = luts
+        return _allreduce_LUTs[key]
+
+
+def fit_alpha_beta(luts):
+    '''
+        (alpha in ns, bus bandwidth in B/s) of a ring allreduce,
+            t = 2(n-1) * alpha + 2(n-1)/n * size / bandwidth,
+            least-squares fitted to the relative error over all measurements
+    '''
+    features = []
+    times = []
+    for num_gpus, lut in luts.items():
+        features.append(np.stack([np.full(lut.sizes.shape, 2 * (num_gpus-1)),
+                                  2 * (num_gpus-1) / num_gpus * lut.sizes], axis=1))
+        times.append(lut.times)
+    features = np.concatenate(features) / np.concatenate(times)[:, None]
+    ones = np.ones(len(features))
+
+    alpha, inv_bandwidth = np.linalg.lstsq(features, ones, rcond=None)[0]
+    if alpha < 0:
+        alpha, inv_bandwidth = 0., np.linalg.lstsq(features[:, 1:], ones, rcond=None)[0][0]
+    return alpha, 10 ** 9 / inv_bandwidth
+
+
+collectives = ["allreduce", "allgather", "reducescatter", "alltoall"]
+algorithms = ["ring", "tree", "hierarchical"]
+
+
+class CollectiveModel():
+    '''
+        alpha-beta cost model of collectives across ``num_gpus`` GPUs, of which
+            ``gpus_per_node`` share a node
+        intra-node steps take ``intra_latency`` (ns) and run at
+            ``intra_bandwidth`` (B/s per GPU), inter-node steps take
+            ``inter_latency`` and share the ``node_bandwidth`` (B/s) of the
+            node's NICs among ``flows_per_nic`` GPUs communicating across
+            nodes at once (default: the GPUs of the group)
+        ``size`` is the buffer size of allreduce, the output size of
+            all-gather, the input size of reduce-scatter and the data sent
+            by every GPU in all-to-all; it may be an array of sizes
+    '''
+    def __init__(self, intra_latency, intra_bandwidth, inter_latency, node_bandwidth):
+        self.intra_latency = intra_latency
+        self.intra_bandwidth = intra_bandwidth
+        self.inter_latency = inter_latency
+        self.node_bandwidth = node_bandwidth
+
+    def __call__(self, collective, algorithm, size, num_gpus, gpus_per_node, flows_per_nic=None):
+        if collective not in collectives:
+            raise ValueError(f"unknown collective: {collective} (one of {', '.join(collectives)})")
+        if algorithm not in algorithms:
+            raise ValueError(f"unknown collective algorithm: {algorithm} (one of {', '.join(algorithms)})")
+
+        size = np.asarray(size, dtype=np.float64)
+        gpus_per_node = min(gpus_per_node, num_gpus)
+        # inter-node bandwidth of every GPU
+        bandwidth = self.node_bandwidth / max(flows_per_nic or gpus_per_node, gpus_per_node)
+        if num_gpus <= 1:
+            t = np.zeros_like(size)
+        elif algorithm == "tree":
+            t = self.tree(collective, size, num_gpus, gpus_per_node, bandwidth)
+        elif algorithm == "hierarchical" and gpus_per_node < num_gpus:
+            t = self.hierarchical(collective, size, num_gpus, gpus_per_node, bandwidth)
+        else:
+            # a hierarchical collective within a node is a ring
+            t = self.ring(collective, size, num_gpus, gpus_per_node, bandwidth)
+        return t if np.ndim(t) else float(t)
+
+    def link(self, n, g, inter_bandwidth):
+        # (latency, bandwidth) of the slowest link of a flat algorithm
+        if g >= n:
+            return self.intra_latency, self.intra_bandwidth
+        # the group's GPUs of a node share their part of the node's NICs
+        return self.inter_latency, min(self.intra_bandwidth, g * inter_bandwidth)
+
+    def ring(self, collective, size, n, g, inter_bandwidth):
+        alpha, bandwidth = self.link(n, g, inter_bandwidth)
+        if collective == "allreduce":
+            return 2 * (n-1) * alpha + 2 * (n-1) / n * size / bandwidth * (10 ** 9)
+        if collective == "alltoall":
+            return self.alltoall(size, n, g, inter_bandwidth, n - 1)
+        return (n-1) * alpha + (n-1) / n * size / bandwidth * (10 ** 9)
+
+    def tree(self, collective, size, n, g, inter_bandwidth):
+        # double binary tree allreduce, recursive doubling/halving all-gather
+        # and reduce-scatter, Bruck all-to-all
+        alpha, bandwidth = self.link(n, g, inter_bandwidth)
+        depth = np.ceil(np.log2(n))
+        if collective == "allreduce":
+            return 2 * depth * alpha + 2 * size / bandwidth * (10 ** 9)
+        if collective == "alltoall":
+            return depth * alpha + depth / 2 * size / bandwidth * (10 ** 9)
+        return depth * alpha + (n-1) / n * size / bandwidth * (10 ** 9)
+
+    def alltoall(self, size, n, g, inter_bandwidth, steps):
+        # pairwise exchange, limited by either NVLink or the traffic leaving the node
+        alpha = self.intra_latency if g >= n else self.inter_latency
+        intra = (g-1) / n * size / self.intra_bandwidth
+        inter = (n-g) / n * size / inter_bandwidth
+        return steps * alpha + np.maximum(intra, inter) * (10 ** 9)
+
+    def hierarchical(self, collective, size, n, g, inter_bandwidth):
+        # intra-node reduce-scatter -> inter-node allreduce -> intra-node all-gather,
+        # the g GPUs of a node run the inter-node step on 1/g of the data each
+        m = n // g
+        intra = (g-1) * self.intra_latency + (g-1) / g * size / self.intra_bandwidth * (10 ** 9)
+        if collective == "allreduce":
+            return 2 * intra + 2 * (m-1) * self.inter_latency + \
+                    2 * (m-1) / m * size / (g * inter_bandwidth) * (10 ** 9)
+        if collective == "alltoall":
+            return intra + (m-1) * self.inter_latency + (m-1) / m * size / inter_bandwidth * (10 ** 9)
+        return intra + (m-1) * self.inter_latency + (m-1) / m * size / (g * inter_bandwidth) * (10 ** 9)
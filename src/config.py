@@ -1,4 +1,6 @@
 from typing import Optional, Any
+import os
+import glob
 import json
 
 
@@ -21,12 +23,34 @@ class vTrainConfig:
         max_length (int): Maximum sequence length.
         use_gradient_bucket (bool): Whether PyTorch DDP's gradient bucketing is used or not.
         use_checkpoint (bool): Whether activation checkpointing is used or not.
-        ddp_bucket_size (int): The size of gradient bucket used in PyTorch DDP (bytes).
+        ddp_bucket_size (int): The size of gradient bucket used in PyTorch DDP in MB (default: None, i.e. 25MB).
+        data_parallel_mode (str): Data parallelism, one of "ddp" (replicated), "zero1" (sharded optimizer
+            states), "zero2" (sharded gradients and optimizer states) and "fsdp" (ZeRO-3, sharded
+            parameters, gradients and optimizer states) (default: "ddp").
+        fsdp_prefetch_depth (int): Number of layers whose parameters are gathered ahead of
+            computation with data_parallel_mode "fsdp" (default: 1).
+        comm_sm_contention (float): Slowdown of compute overlapping an asynchronous data-parallel
+            collective, as a fraction of the collective's duration (default: 0.0).
         inter_node_bandwidth (int): Total bandwidth of inter-node communication in Gbps.
         intra_node_bandwidth (int): Total bandwidth of intra-node communication in GB/s.
-        pipeline_scheduling (str): Pipeline scheduling (default: "1f1b")
+        p2p_latency (float): Latency (alpha) of a point-to-point message in us, i.e. of pipeline-parallel
+            send/recv and of the inter-node steps of collectives (default: 5.0).
+        collective_algorithms (dict): Algorithm estimating each collective ("allreduce", "allgather",
+            "reducescatter", "alltoall") which is not measured in the allreduce LUT, one of "ring",
+            "tree" and "hierarchical" (default: None, i.e. "ring" for every collective).
+        pipeline_scheduling (str): Pipeline scheduling, one of "gpipe", "1f1b", "interleaved"
+            and "zero_bubble" (default: "1f1b")
+        virtual_pipeline_size (int): Number of model chunks (virtual stages) per pipeline rank
+            with the interleaved pipeline scheduling (default: 1).
         node_size (int): Number of GPUs within a node.
+        hbm_capacity (float): Memory of a GPU in GB (2^30 bytes); batch runs reject configs whose
+            estimated peak memory exceeds it (default: None, i.e. not checked).
+        placement_order (str): Order in which tensor-, data- and pipeline-parallel ranks are placed onto
+            consecutive GPUs, from the fastest-varying, e.g. "tp-dp-pp" (default) or "dp-tp-pp".
         trace_path (str): Path where GPU kernel traces exist and are going to be stored.
+        steady_state_periods (int): Number of steady-state 1F1B periods to simulate before
+            extrapolating the iteration time, raised to pipeline_parallel_size as the pipeline takes
+            about as many microbatches to settle (default: None, i.e. simulate every microbatch).
     """
     
     def __init__(self,
@@ -46,11 +70,20 @@ class vTrainConfig:
                  use_gradient_bucket: bool                  = False,
                  use_checkpoint: bool                       = True,
                  ddp_bucket_size: Optional[int]             = None,                 # MB
+                 data_parallel_mode: str                    = "ddp",
+                 fsdp_prefetch_depth: int                   = 1,
+                 comm_sm_contention: float                  = 0.0,
                  inter_node_bandwidth: int                  = 800,                  # Gbps
                  intra_node_bandwidth: int                  = 150,                  # GB/s
+                 p2p_latency: float                         = 5.0,                  # us
+                 collective_algorithms: Optional[dict]      = None,
                  pipeline_scheduling: str                   = "1f1b",
+                 virtual_pipeline_size: int                 = 1,
                  node_size: int                             = 8,
-                 trace_path: str                            = "trace/"
+                 hbm_capacity: Optional[float]              = None,                 # GB
+                 placement_order: str                       = "tp-dp-pp",
+                 trace_path: str                            = "trace/",
+                 steady_state_periods: Optional[int]        = None
                  ):
         
         self.num_gpus = num_gpus
@@ -68,11 +101,20 @@ class vTrainConfig:
         self.use_gradient_bucket = use_gradient_bucket
         self.use_checkpoint = use_checkpoint
         self.ddp_bucket_size = ddp_bucket_size
+        self.data_parallel_mode = data_parallel_mode
+        self.fsdp_prefetch_depth = fsdp_prefetch_depth
+        self.comm_sm_contention = comm_sm_contention
         self.pipeline_scheduling = pipeline_scheduling
+        self.virtual_pipeline_size = virtual_pipeline_size
         self.inter_node_bandwidth = inter_node_bandwidth
         self.intra_node_bandwidth = intra_node_bandwidth
+        self.p2p_latency = p2p_latency
+        self.collective_algorithms = collective_algorithms
         self.node_size = node_size
+        self.hbm_capacity = hbm_capacity
+        self.placement_order = placement_order
         self.trace_path = trace_path
+        self.steady_state_periods = steady_state_periods
         
         # target model
         self.model_arch = model_arch
@@ -84,6 +126,50 @@ class vTrainConfig:
     def validate_config(self):
         """Validate configuration constraints."""
         
+        self.derive_sizes()
+            
+        assert self.global_batch_size % self.data_parallel_size == 0, \
+            "global_batch_size must be divisible by data_parallel_size."
+        assert self.global_batch_size % self.micro_batch_size == 0, \
+            "global_batch_size must be divisible by micro_batch_size."
+        assert (self.global_batch_size // self.data_parallel_size) % self.micro_batch_size == 0, \
+            "global_batch_size // data_parallel_size must be divisible by micro_batch_size."
+        assert self.num_layers % self.pipeline_parallel_size == 0, \
+            "num_layers must be divisible by pipeline_parallel_size."
+        assert self.virtual_pipeline_size == 1 or self.pipeline_scheduling == "interleaved", \
+            "virtual_pipeline_size is only supported by the interleaved pipeline scheduling."
+        assert self.num_layers % (self.pipeline_parallel_size * self.virtual_pipeline_size) == 0, \
+            "num_layers must be divisible by (pipeline_parallel_size * virtual_pipeline_size)."
+        assert self.pipeline_scheduling != "interleaved" or \
+            (self.global_batch_size // self.data_parallel_size // self.micro_batch_size) % self.pipeline_parallel_size == 0, \
+            "the interleaved pipeline scheduling requires the number of microbatches to be divisible by pipeline_parallel_size."
+        assert self.hidden_size % self.num_attention_heads == 0, \
+            "hidden_size must be divisible by num_attention_heads."
+        assert self.num_attention_heads % self.tensor_parallel_size == 0, \
+            "num_attention_heads must be divisible by tensor_parallel_size."
+        assert self.data_parallel_mode in ["ddp", "zero1", "zero2", "fsdp"], \
+            "data_parallel_mode must be one of 'ddp', 'zero1', 'zero2' and 'fsdp'."
+        assert self.fsdp_prefetch_depth >= 0, \
+            "fsdp_prefetch_depth must be non-negative."
+        assert self.comm_sm_contention >= 0, \
+            "comm_sm_contention must be non-negative."
+        assert self.p2p_latency >= 0, \
+            "p2p_latency must be non-negative."
+        assert self.collective_algorithms is None or \
+            (set(self.collective_algorithms.keys()) <= {"allreduce", "allgather", "reducescatter", "alltoall"} and
+             set(self.collective_algorithms.values()) <= {"ring", "tree", "hierarchical"}), \
+            "collective_algorithms must map collectives to one of 'ring', 'tree' and 'hierarchical'."
+        assert self.hbm_capacity is None or self.hbm_capacity > 0, \
+            "hbm_capacity must be positive."
+        assert sorted(self.placement_order.split("-")) == ["dp", "pp", "tp"], \
+            "placement_order must order 'tp', 'dp' and 'pp', e.g. 'tp-dp-pp'."
+        assert self.steady_state_periods is None or self.steady_state_periods > 0, \
+            "steady_state_periods must be positive."
+        
+
+    def derive_sizes(self):
+        """Derive num_gpus, a missing parallel size and, without pipeline parallelism, micro_batch_size."""
+        
         if self.num_gpus is None:
             assert all(x is not None for x in [self.tensor_parallel_size, self.data_parallel_size, self.pipeline_parallel_size])
             self.num_gpus = self.tensor_parallel_size * self.pipeline_parallel_size * self.data_parallel_size
@@ -106,18 +192,6 @@ class vTrainConfig:
             self.micro_batch_size = self.global_batch_size // self.data_parallel_size
             print (f"[vTrainConfig] micro_batch_size is set by 'global_batch_size // data_parallel_size' as pipeline_parallel_size is 1")
 
-            
-        assert self.global_batch_size % self.data_parallel_size == 0, \
-            "global_batch_size must be divisible by data_parallel_size."
-        assert self.global_batch_size % self.micro_batch_size == 0, \
-            "global_batch_size must be divisible by micro_batch_size."
-        assert self.num_layers % self.pipeline_parallel_size == 0, \
-            "num_layers must be divisible by pipeline_parallel_size."
-        assert self.hidden_size % self.num_attention_heads == 0, \
-            "hidden_size must be divisible by num_attention_heads."
-        assert self.num_attention_heads % self.tensor_parallel_size == 0, \
-            "num_attention_heads must be divisible by tensor_parallel_size."
-        
 
     def save_to_file(self, file_path: str):
         """Save configuration to a JSON file."""
@@ -151,15 +225,38 @@ class vTrainConfig:
             f"  use_gradient_bucket={self.use_gradient_bucket},\n"
             f"  use_checkpoint={self.use_checkpoint},\n"
             f"  ddp_bucket_size={self.ddp_bucket_size},\n"
+            f"  data_parallel_mode='{self.data_parallel_mode}',\n"
+            f"  fsdp_prefetch_depth={self.fsdp_prefetch_depth},\n"
+            f"  comm_sm_contention={self.comm_sm_contention},\n"
             f"  inter_node_bandwidth={self.inter_node_bandwidth},\n"
             f"  intra_node_bandwidth={self.intra_node_bandwidth},\n"
+            f"  p2p_latency={self.p2p_latency},\n"
+            f"  collective_algorithms={self.collective_algorithms},\n"
             f"  pipeline_scheduling='{self.pipeline_scheduling}',\n"
+            f"  virtual_pipeline_size={self.virtual_pipeline_size},\n"
             f"  node_size={self.node_size},\n"
-            f"  trace_path='{self.trace_path}'\n"
+            f"  hbm_capacity={self.hbm_capacity},\n"
+            f"  placement_order='{self.placement_order}',\n"
+            f"  trace_path='{self.trace_path}',\n"
+            f"  steady_state_periods={self.steady_state_periods}\n"
             ")"
         )
 
-    
+
+def load_configs(patterns):
+    # (filename, config) of valid config files, directories are searched recursively
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.json")
+        for filename in sorted(glob.glob(pattern, recursive=True)):
+            try:
+                config = vTrainConfig.load_from_file(filename)
+            except (AssertionError, TypeError) as e:
+                # invalid configs, or other JSON files such as sweep specifications
+                print(f"skipping {filename}: {e}")
+                continue
+            yield filename, config
+
 
 if __name__ == "__main__":
     import os
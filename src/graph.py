@@ -1,6 +1,11 @@
 import matplotlib.pyplot as plt
+import numpy as np
 
+from array import array
+from collections import OrderedDict
+import copy
 import logging
+import threading
 
 logger = logging.getLogger()
 
@@ -91,6 +96,7 @@ class CommNode(Node):
         super(CommNode, self).__init__()
         self.stream = stream
         self.bucket_size = bucket_size
+        self.bucket_idx = 0
         self.duration = 0
         self.start = 0
         self.gap = 0
@@ -127,13 +133,22 @@ class DepGraph():
 
     def __init__(self):
         self.streams = dict()
+        self.groups = dict()
+        self.fences = dict()
 
     
     def create_stream(self, stream):
+        # consecutive nodes of a stream are chained by link()
         if stream not in self.streams.keys():
             self.streams[stream] = []
 
 
+    def create_group(self, group):
+        # consecutive nodes of a group are chained by link()
+        if group not in self.groups.keys():
+            self.groups[group] = []
+
+
     def add_node(self, node, prev=[]):
         # if prev is None:
         #     print ("[ERROR] add_node: one of ``stream`` and ``prev`` must be specified")
@@ -144,11 +159,42 @@ class DepGraph():
         #     self.add_dependency(self.streams[stream][-1], node)
         self.streams[stream].append(node)
 
-        for prevNode in prev:
+        for prevNode in prev + self.fences.pop(stream, []):
             self.add_dependency(prevNode, node)
     
     def append_node_to_stream(self, node, stream):
         self.streams[stream].append(node)
+
+        for prevNode in self.fences.pop(stream, []):
+            self.add_dependency(prevNode, node)
+
+
+    def add_fence(self, stream, node):
+        # the next node appended to ``stream`` waits for ``node``,
+        # e.g. a blocking collective issued from another stream
+        self.fences.setdefault(stream, []).append(node)
+
+
+    def add_to_group(self, group, node):
+        self.groups[group].append(node)
+
+
+    def last_node(self, stream):
+        return self.streams[stream][-1]
+
+
+    def last_nodes(self):
+        return [nodes[-1] for nodes in self.streams.values() if nodes]
+
+
+    def link(self):
+        for nodes in self.streams.values():
+            for i in range(len(nodes)-1):
+                nodes[i].add_dependency(nodes[i+1])
+
+        for nodes in self.groups.values():
+            for i in range(len(nodes)-1):
+                nodes[i].add_dependency(nodes[i+1])
     
     def add_dependency(self, parent, child):
         parent.add_dependency(child)
@@ -197,17 +243,15 @@ class DepGraph():
     def show_graph(self):
         timeline = {}
         for stream, tasks in self.streams.items():
-            if stream == "Comm":
-                continue
             if len(tasks) == 0:
                 continue
             # timeline[stream] = []
             timeline[stream] = {"fwd": [], "bwd": [], "wu": [], "comm": []}
             for u in tasks:
-                stage = u.function.split("_")[0].lower()
-                if stage == "allreduce":
-                    stage = "comm"
-                timeline[stream][stage].append((u.start, u.duration))
+                stage = "comm" if u.is_comm_node() else u.function.split("_")[0].lower()
+                if stage.startswith("bwd"):
+                    stage = "bwd"
+                timeline[stream].setdefault(stage, []).append((u.start, u.duration))
 
         plt.close('all')
         px = 1/plt.rcParams['figure.dpi']
@@ -234,3 +278,512 @@ class DepGraph():
         plt.subplots_adjust(left=0, bottom=0, right=1, top=1)
 
         plt.show()
+
+
+
+def to_csr(num_nodes, src, dst):
+    # drop duplicated edges, keeping the first insertion
+    key = src.astype(np.int64) * num_nodes + dst
+    _, first = np.unique(key, return_index=True)
+    first.sort()
+    src, dst = src[first], dst[first]
+
+    # CSR of children, ordered by insertion within each parent
+    order = np.argsort(src, kind="stable")
+    indices = dst[order].astype(np.int32)
+    indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+
+    return indptr, indices
+
+
+class StreamingGraph():
+    '''
+        sink with the construction interface of DepGraph which predicts
+            while the graph is being built: nodes are created in a topological
+            order, so a node is timed (Algorithm 1) as soon as the next one is
+            added, and only the last node of every stream and group is kept
+        memory is bounded by the number of streams and groups, not by the
+            number of nodes; layer nodes are expanded to kernels on the fly
+        a node must be fully described (streams, groups) before the next
+            node is added
+    '''
+    def __init__(self, kernel_dict):
+        self.kernel_dict = kernel_dict
+        self.tails = dict()
+        self.group_tails = dict()
+        self.fences = dict()
+        self.refs = dict()
+
+        self.pending = None
+        self.parents = []
+        self.num_nodes = 0
+
+        self.P = dict()
+        self.P_brk = dict()
+
+    def create_stream(self, stream):
+        if stream not in self.tails.keys():
+            self.tails[stream] = None
+            self.P[stream] = 0.
+            self.P_brk[stream] = {"compute": 0., "comm": 0.}
+
+    def create_group(self, group):
+        if group not in self.group_tails.keys():
+            self.group_tails[group] = None
+
+    def add_node(self, node, prev=[]):
+        self.seal()
+        self.pending = node
+        self.parents = list(prev)
+        self.refs[id(node)] = [node, 1]
+        self.num_nodes += 1
+        self.append_node_to_stream(node, node.stream)
+
+    def append_node_to_stream(self, node, stream):
+        assert node is self.pending, "append_node_to_stream - only the last added node can be appended"
+        self.parents.append(self.tails[stream])
+        self.parents += self.fences.pop(stream, [])
+        self.retain(node)
+        self.release(self.tails[stream])
+        self.tails[stream] = node
+
+    def add_to_group(self, group, node):
+        assert node is self.pending, "add_to_group - only the last added node can be grouped"
+        self.parents.append(self.group_tails[group])
+        self.retain(node)
+        self.release(self.group_tails[group])
+        self.group_tails[group] = node
+
+    def add_fence(self, stream, node):
+        # fenced nodes are sealed (timed) before the next node is added
+        self.fences.setdefault(stream, []).append(node)
+
+    def last_node(self, stream):
+        return self.tails[stream]
+
+    def last_nodes(self):
+        return [node for node in self.tails.values() if node is not None]
+
+    def link(self):
+        # dependencies are resolved while nodes are added
+        pass
+
+    def finish(self):
+        '''
+            time the remaining nodes and return per-stream makespan and breakdown
+        '''
+        self.seal()
+        for node, _ in list(self.refs.values()):
+            self.retire(node)
+        self.refs.clear()
+        self.tails.clear()
+        self.group_tails.clear()
+
+        logger.info(f"streamed prediction of {self.num_nodes} nodes")
+        return self.P, self.P_brk
+
+    def seal(self):
+        node = self.pending
+        if node is None:
+            return
+        for p in self.parents:
+            if p is not None:
+                node.start = max(node.start, self.end(p))
+        self.pending = None
+        self.parents = []
+        self.release(node)
+
+    def retain(self, node):
+        self.refs[id(node)][1] += 1
+
+    def release(self, node):
+        if node is None:
+            return
+        ref = self.refs[id(node)]
+        ref[1] -= 1
+        if ref[1] == 0:
+            # neither pending nor the last node of a stream or group,
+            # so nothing can depend on it (or change its gap) anymore
+            del self.refs[id(node)]
+            self.retire(node)
+
+    def tasks(self, node):
+        # (duration, gap) of the kernels replacing a layer node
+        nodeInfo = self.kernel_dict.get(node.function, [])
+        if len(nodeInfo) == 0:
+            return [(node.duration, node.gap)]
+        return [(info[0], info[-1]) for info in nodeInfo[:-1]] + [(nodeInfo[-1][0], node.gap)]
+
+    def end(self, node):
+        t = node.start
+        for duration, gap in self.tasks(node):
+            t = t + duration + gap
+        return t
+
+    def retire(self, node):
+        stream = node.stream
+        kind = "comm" if node.is_comm_node() else "compute"
+        t = node.start
+        for duration, gap in self.tasks(node):
+            t = t + duration + gap
+            self.P[stream] = max(self.P[stream], t)
+            self.P_brk[stream][kind] += duration
+
+
+class GraphBuilder():
+    '''
+        incremental builder of a CompactGraph
+        nodes are identified by integer ids in insertion order and
+        edges are only recorded here, so insertion is O(1)
+        the builder must not be extended after build(), as the
+        CompactGraph shares its buffers
+    '''
+    def __init__(self):
+        self.stream_ids = dict()
+        self.function_ids = dict()
+        self.stream_nodes = []
+
+        self.node_stream = array('i')
+        self.node_function = array('i')
+        self.duration = array('d')
+        self.gap = array('d')
+        self.comm = array('b')
+
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+
+    def __len__(self):
+        return len(self.duration)
+
+    def create_stream(self, stream):
+        if stream not in self.stream_ids:
+            self.stream_ids[stream] = len(self.stream_ids)
+            self.stream_nodes.append(array('i'))
+        return self.stream_ids[stream]
+
+    def add_node(self, stream, duration, gap=0, function="", comm=False):
+        node = len(self.duration)
+        stream_id = self.create_stream(stream)
+        if function not in self.function_ids:
+            self.function_ids[function] = len(self.function_ids)
+
+        self.node_stream.append(stream_id)
+        self.node_function.append(self.function_ids[function])
+        self.duration.append(duration)
+        self.gap.append(gap)
+        self.comm.append(comm)
+        self.stream_nodes[stream_id].append(node)
+        return node
+
+    def append_node_to_stream(self, node, stream):
+        self.stream_nodes[self.create_stream(stream)].append(node)
+
+    def add_dependency(self, parent, child):
+        self.edge_src.append(parent)
+        self.edge_dst.append(child)
+
+    def build(self):
+        num_nodes = len(self.duration)
+        src = np.frombuffer(self.edge_src, dtype=np.int32)
+        dst = np.frombuffer(self.edge_dst, dtype=np.int32)
+
+        indptr, indices = to_csr(num_nodes, src, dst)
+
+        functions = [None] * len(self.function_ids)
+        for function, idx in self.function_ids.items():
+            functions[idx] = function
+
+        # node columns share the builder's buffers
+        return CompactGraph(streams=list(self.stream_ids.keys()),
+                            stream_nodes=[np.frombuffer(nodes, dtype=np.int32) for nodes in self.stream_nodes],
+                            functions=functions,
+                            node_stream=np.frombuffer(self.node_stream, dtype=np.int32),
+                            node_function=np.frombuffer(self.node_function, dtype=np.int32),
+                            duration=np.frombuffer(self.duration, dtype=np.float64),
+                            gap=np.frombuffer(self.gap, dtype=np.float64),
+                            comm=np.frombuffer(self.comm, dtype=np.bool_),
+                            indptr=indptr,
+                            indices=indices)
+
+
+class CompactGraph():
+    '''
+        array-backed dependency graph
+        node attributes are stored column-wise and children in CSR form,
+            i.e. children of node u are indices[indptr[u]:indptr[u+1]]
+        stream_nodes keeps the per-stream node order of DepGraph.streams
+        members maps the nodes of the graph this one was contracted from
+            to the nodes of this graph
+    '''
+    def __init__(self, streams, stream_nodes, functions, node_stream, node_function,
+                 duration, gap, comm, indptr, indices, members=None):
+        self.streams = streams
+        self.stream_nodes = stream_nodes
+        self.functions = functions
+
+        self.node_stream = node_stream
+        self.node_function = node_function
+        self.duration = duration
+        self.gap = gap
+        self.comm = comm
+        self.start = np.zeros(len(duration), dtype=np.float64)
+
+        self.indptr = indptr
+        self.indices = indices
+        self.indeg = np.bincount(indices, minlength=len(duration)).astype(np.int32)
+        self.members = members
+
+        # shared by every copy returned by with_timing()
+        self.cache = dict()
+
+    def __len__(self):
+        return len(self.duration)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        arrays = [self.node_stream, self.node_function, self.duration, self.gap,
+                  self.comm, self.start, self.indptr, self.indices, self.indeg]
+        return sum(a.nbytes for a in arrays) + sum(a.nbytes for a in self.stream_nodes)
+
+    def contract(self):
+        '''
+            collapse every chain u -> v, where u has a single child, v has a
+                single parent and both are on the same stream and of the same
+                kind (compute or comm), into one node with summed duration and gap
+            chains keep their start and end times, so makespans and the
+                compute/comm breakdown are unchanged
+        '''
+        num_nodes = len(self)
+        outdeg = np.diff(self.indptr)
+        src = np.flatnonzero(outdeg == 1)
+        dst = self.indices[self.indptr[src]]
+        merge = (self.indeg[dst] == 1) & \
+                (self.node_stream[src] == self.node_stream[dst]) & \
+                (self.comm[src] == self.comm[dst])
+        src, dst = src[merge], dst[merge]
+
+        # point every node at the head of its chain
+        head = np.arange(num_nodes)
+        head[dst] = src
+        while True:
+            jump = head[head]
+            if np.array_equal(jump, head):
+                break
+            head = jump
+        heads = np.flatnonzero(head == np.arange(num_nodes))
+        new_id = np.zeros(num_nodes, dtype=np.int64)
+        new_id[heads] = np.arange(heads.size)
+        new_id = new_id[head]
+
+        # edges inside a chain are the single out edges of their parents
+        keep = np.ones(self.num_edges, dtype=np.bool_)
+        keep[self.indptr[src]] = False
+        edge_src = np.repeat(np.arange(num_nodes), outdeg)[keep]
+        indptr, indices = to_csr(heads.size, new_id[edge_src], new_id[self.indices[keep]])
+
+        stream_nodes = []
+        for members in self.stream_nodes:
+            ids = new_id[members]
+            _, first = np.unique(ids, return_index=True)
+            stream_nodes.append(ids[np.sort(first)].astype(np.int32))
+
+        return CompactGraph(streams=self.streams,
+                            stream_nodes=stream_nodes,
+                            functions=self.functions,
+                            node_stream=self.node_stream[heads],
+                            node_function=self.node_function[heads],
+                            duration=np.bincount(new_id, weights=self.duration, minlength=heads.size),
+                            gap=np.bincount(new_id, weights=self.gap, minlength=heads.size),
+                            comm=self.comm[heads],
+                            indptr=indptr,
+                            indices=indices,
+                            members=new_id)
+
+    def with_timing(self, duration, gap):
+        '''
+            shallow copy sharing the structure (and its compiled levels)
+                with new node durations and gaps
+        '''
+        timed = copy.copy(self)
+        timed.duration = duration
+        timed.gap = gap
+        timed.start = np.zeros(len(self), dtype=np.float64)
+        return timed
+
+    def compile_levels(self):
+        '''
+            group nodes by topological level (longest distance in edges
+                from a source) and order edges by the level of their parent
+            returns (node_order, level_ptr, edge_src, edge_dst, edge_ptr):
+                level l holds nodes node_order[level_ptr[l]:level_ptr[l+1]]
+                and the edges leaving them are edge_src/edge_dst[edge_ptr[l]:edge_ptr[l+1]]
+        '''
+        if "levels" in self.cache:
+            return self.cache["levels"]
+
+        indptr, indices = self.indptr, self.indices
+        indeg = self.indeg.copy()
+        frontier = np.flatnonzero(indeg == 0).astype(np.int32)
+
+        node_order, level_ptr = [], [0]
+        edge_src, edge_dst, edge_ptr = [], [], [0]
+        while frontier.size:
+            first, count = indptr[frontier], indptr[frontier+1] - indptr[frontier]
+            offsets = np.repeat(first - np.cumsum(count) + count, count)
+            edges = offsets + np.arange(offsets.size, dtype=offsets.dtype)
+            children = indices[edges]
+
+            node_order.append(frontier)
+            level_ptr.append(level_ptr[-1] + frontier.size)
+            edge_src.append(np.repeat(frontier, count))
+            edge_dst.append(children)
+            edge_ptr.append(edge_ptr[-1] + children.size)
+
+            # release children whose parents are all scheduled
+            touched, hits = np.unique(children, return_counts=True)
+            indeg[touched] -= hits.astype(np.int32)
+            frontier = touched[indeg[touched] == 0]
+
+        if level_ptr[-1] != len(self):
+            logger.error(f"compile_levels - {len(self) - level_ptr[-1]} nodes are on a cycle")
+
+        empty = np.zeros(0, dtype=np.int32)
+        self.cache["levels"] = (np.concatenate(node_order) if node_order else empty,
+                                np.array(level_ptr, dtype=np.int64),
+                                np.concatenate(edge_src) if edge_src else empty,
+                                np.concatenate(edge_dst) if edge_dst else empty,
+                                         np.array(edge_ptr, dtype=np.int64))
+        return self.cache["levels"]
+
+    def to_depgraph(self):
+        '''
+            debug view: materialize the compact graph as a DepGraph of
+                TaskNode/CommNode objects carrying the current start times
+        '''
+        graph = DepGraph()
+        nodes = []
+        for u in range(len(self)):
+            stream = self.streams[self.node_stream[u]]
+            function = self.functions[self.node_function[u]]
+            if self.comm[u]:
+                node = CommNode(0, stream, function)
+                node.duration = float(self.duration[u])
+                node.gap = float(self.gap[u])
+            else:
+                node = TaskNode(float(self.duration[u]), function, stream, None, float(self.gap[u]))
+                node.function = function
+            node.start = float(self.start[u])
+            nodes.append(node)
+
+        for stream, members in zip(self.streams, self.stream_nodes):
+            graph.create_stream(stream)
+            for u in members:
+                graph.append_node_to_stream(nodes[u], stream)
+
+        for u in range(len(self)):
+            for c in self.indices[self.indptr[u]:self.indptr[u+1]]:
+                nodes[u].add_child(nodes[c])
+                nodes[c].add_parent(nodes[u])
+        for node in nodes:
+            node.ref = len(node.parent)
+
+        return graph
+
+
+class GraphTopology():
+    '''
+        timing-independent part of a simulation
+        graph is the layer-level CompactGraph and columns describe its nodes
+            (e.g. pipeline rank), so that durations can be recomputed for it;
+            retime() folds them into the contracted graph used for prediction
+    '''
+    def __init__(self, graph, columns):
+        self.graph = graph
+        self.columns = columns
+        self.contracted = graph.contract()
+
+    @property
+    def nbytes(self):
+        levels = self.contracted.cache.get("levels", [])
+        return self.graph.nbytes + self.contracted.nbytes + self.contracted.members.nbytes + \
+                sum(c.nbytes for c in self.columns.values()) + sum(a.nbytes for a in levels)
+
+    def retime(self, duration, gap):
+        # duration and gap may carry a trailing scenario axis, i.e. (num_nodes, K)
+        return self.contracted.with_timing(self.fold(duration), self.fold(gap))
+
+    def fold(self, values):
+        # sum values of the layer-level nodes into their contracted nodes
+        folded = np.zeros((len(self.contracted),) + values.shape[1:], dtype=np.float64)
+        np.add.at(folded, self.contracted.members, values)
+        return folded
+
+
+class TopologyCache():
+    '''
+        process-wide LRU cache of GraphTopology objects
+        least recently used entries are evicted once their total size
+            exceeds max_bytes (the most recent entry is always kept)
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def nbytes(self):
+        return sum(topology.nbytes for topology in self.entries.values())
+
+    def get(self, key):
+        with self.lock:
+            topology = self.entries.get(key)
+            if topology is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                # compiled levels may have grown the entry
+                self.evict()
+            return topology
+
+    def put(self, key, topology):
+        with self.lock:
+            self.entries[key] = topology
+            self.entries.move_to_end(key)
+            self.evict()
+
+    def evict(self):
+        size = self.nbytes
+        while size > self.max_bytes and len(self.entries) > 1:
+            _, topology = self.entries.popitem(last=False)
+            size -= topology.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.nbytes}
@@ -0,0 +1,66 @@
+import numpy as np
+
+from itertools import permutations
+
+
+dims = ["tp", "dp", "pp"]
+
+# every ordering of the parallel dimensions, from the fastest-varying rank
+placement_orders = ["-".join(order) for order in permutations(dims)]
+
+
+class Placement():
+    '''
+        mapping of (tp, dp, pp) ranks onto GPUs and nodes
+        ``order`` lists the parallel dimensions from the fastest- to the
+            slowest-varying rank, e.g. "tp-dp-pp" (Megatron-LM) numbers the
+            GPUs of a tensor-parallel group consecutively, then the data-parallel
+            replicas of a stage, then the stages; GPU ``g`` is on node
+            ``g // node_size``
+        a group along a dimension are the GPUs whose other ranks are equal,
+            a flow is a GPU of a node communicating across nodes
+    '''
+    def __init__(self, tp, dp, pp, node_size, order="tp-dp-pp"):
+        if sorted(order.split("-")) != sorted(dims):
+            raise ValueError(f"unknown placement order: {order} (one of {', '.join(placement_orders)})")
+        self.sizes = {"tp": tp, "dp": dp, "pp": pp}
+        self.node_size = node_size
+        self.order = order
+
+        stride = 1
+        gpu = np.zeros((tp, dp, pp), dtype=np.int64)
+        for dim in order.split("-"):
+            shape = [1, 1, 1]
+            shape[dims.index(dim)] = self.sizes[dim]
+            gpu += np.arange(self.sizes[dim]).reshape(shape) * stride
+            stride *= self.sizes[dim]
+        # node of every GPU, indexed by [tp rank, dp rank, pp rank]
+        self.node = gpu // node_size
+
+        # fewest GPUs a group along a dimension has on one of its nodes
+        self.gpus_per_node = dict()
+        # most GPUs of a node in groups along a dimension which span several nodes
+        self.flows_per_nic = dict()
+        for dim in dims:
+            groups = self.groups(dim)
+            self.gpus_per_node[dim] = int(min(np.unique(nodes, return_counts=True)[1].min() for nodes in groups))
+            spanning = groups[(groups != groups[:, :1]).any(axis=1)]
+            self.flows_per_nic[dim] = int(np.bincount(spanning.ravel()).max()) if spanning.size else 0
+
+        self.links = dict()
+
+    def groups(self, dim):
+        # nodes of the groups along ``dim``, one row per group
+        return np.moveaxis(self.node, dims.index(dim), -1).reshape(-1, self.sizes[dim])
+
+    def link_flows(self, rank, peer):
+        '''
+            most GPUs of a node sending to another node from pipeline rank
+                ``rank`` to ``peer``, 0 if every transfer stays within a node
+        '''
+        if (rank, peer) not in self.links:
+            src = self.node[:, :, rank].ravel()
+            dst = self.node[:, :, peer].ravel()
+            crossing = src[src != dst]
+            self.links[(rank, peer)] = int(np.bincount(crossing).max()) if crossing.size else 0
+        return self.links[(rank, peer)]
@@ -0,0 +1,152 @@
+'''
+    branch-and-bound search of the parallelism layout for a GPU budget
+    every (tensor, pipeline, data parallel size, micro-batch size) accepted
+        by vTrainConfig.validate_config is a candidate; candidates are
+        visited by increasing lower bound (vTrain.get_lower_bound, from the
+        kernel traces without building the graph) and only simulated while
+        their bound is below the k-th best simulated iteration time
+'''
+from .predictor import vTrain
+from .config import vTrainConfig
+from .trace_store import TraceStore
+from .result_store import ResultStore
+
+import copy
+import time
+import logging
+
+import argparse
+
+logger = logging.getLogger()
+
+
+def divisors(n):
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+
+def candidates(config: vTrainConfig, num_gpus, micro_batch_sizes):
+    '''
+        copies of ``config`` with every valid layout of ``num_gpus`` GPUs
+    '''
+    layouts = set()
+    for tp in divisors(num_gpus):
+        for pp in divisors(num_gpus // tp):
+            for micro_batch_size in micro_batch_sizes:
+                candidate = copy.copy(config)
+                candidate.num_gpus = num_gpus
+                candidate.tensor_parallel_size = tp
+                candidate.pipeline_parallel_size = pp
+                candidate.data_parallel_size = num_gpus // (tp * pp)
+                candidate.micro_batch_size = micro_batch_size
+                try:
+                    candidate.validate_config()
+                except AssertionError:
+                    continue
+
+                # the micro-batch size is derived without pipeline parallelism
+                layout = (tp, pp, candidate.data_parallel_size, candidate.micro_batch_size)
+                if layout not in layouts:
+                    layouts.add(layout)
+                    yield candidate
+
+
+def layout_of(config: vTrainConfig):
+    return (f"tp={config.tensor_parallel_size}, pp={config.pipeline_parallel_size}, "
+            f"dp={config.data_parallel_size}, mbs={config.micro_batch_size}")
+
+
+def search_layouts(config: vTrainConfig, num_gpus=None, micro_batch_sizes=None, top_k=5,
+                   engine="numpy", traced_only=False, result_store=None):
+    '''
+        the ``top_k`` fastest layouts of ``num_gpus`` GPUs (default: config.num_gpus)
+            with micro-batch sizes ``micro_batch_sizes`` (default: powers of
+            two up to 16) as [(iteration time, config)] from the fastest,
+            and the number of candidates, simulated, pruned and failed ones
+        with ``traced_only``, candidates whose kernels are not traced yet
+            are skipped instead of profiled; candidates exceeding the
+            hbm_capacity of ``config`` are rejected
+    '''
+    num_gpus = num_gpus or config.num_gpus
+    micro_batch_sizes = micro_batch_sizes or [1, 2, 4, 8, 16]
+
+    # bound: cheap analytical lower bounds of every candidate
+    bounds = []
+    num_skipped = 0
+    num_rejected = 0
+    num_failed = 0
+    for candidate in candidates(config, num_gpus, micro_batch_sizes):
+        sim = vTrain(candidate, result_store=result_store)
+        try:
+            if not sim.fits_in_memory():
+                num_rejected += 1
+                continue
+            if traced_only and TraceStore(candidate.trace_path).lookup(candidate) is None:
+                num_skipped += 1
+                continue
+            bounds.append((sim.get_lower_bound(sim.profile()), len(bounds), sim))
+        except (AssertionError, ValueError) as e:
+            # e.g. a pipeline schedule which cannot run this layout
+            logger.warning(f"{layout_of(candidate)}: {e}")
+            num_failed += 1
+    bounds.sort(key=lambda bound: bound[:2])
+
+    # branch: simulate from the lowest bound until it exceeds the k-th best
+    ranking = []
+    num_simulated = 0
+    for lower_bound, _, sim in bounds:
+        if len(ranking) == top_k and lower_bound >= ranking[-1][0]:
+            break
+        result, _ = sim(engine=engine)
+        num_simulated += 1
+        ranking.append((max(result.values()), sim.config))
+        ranking.sort(key=lambda entry: entry[0])
+        del ranking[top_k:]
+
+    stats = {"candidates": len(bounds) + num_skipped + num_rejected + num_failed,
+             "simulated": num_simulated,
+             "pruned": len(bounds) - num_simulated,
+             "skipped": num_skipped,
+             "rejected": num_rejected,
+             "failed": num_failed}
+    return ranking, stats
+
+
+def main(args):
+    config = vTrainConfig.load_from_file(args.config)
+    if args.hbm_capacity is not None:
+        config.hbm_capacity = args.hbm_capacity
+    result_store = ResultStore(args.store) if args.store is not None else None
+
+    logger.setLevel(logging.WARNING)
+    start = time.perf_counter()
+    ranking, stats = search_layouts(config, args.num_gpus, args.micro_batch_sizes, args.top_k,
+                                    args.engine, args.traced_only, result_store)
+    elapsed = time.perf_counter() - start
+    logger.setLevel(logging.INFO)
+
+    for iter_time, candidate in ranking:
+        logger.info(f"{layout_of(candidate)}: {iter_time/1000/1000:.3f} ms")
+    logger.info(f"{stats['candidates']} layouts in {elapsed:.2f}s: {stats['simulated']} simulated, "
+                f"{stats['pruned']} pruned by their lower bound, {stats['skipped']} skipped (not traced), "
+                f"{stats['rejected']} rejected (out of memory), {stats['failed']} failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the fastest parallelism layouts of a GPU budget")
+    parser.add_argument("-c, --config", type=str, dest="config",
+                        help="config of the model, training and system, its layout is ignored")
+    parser.add_argument("--num_gpus", type=int, default=None,
+                        help="GPU budget (default: num_gpus of the config)")
+    parser.add_argument("--micro_batch_sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--engine", type=str, default="numpy",
+                        choices=["event", "reference", "compact", "numpy", "streaming"])
+    parser.add_argument("--traced_only", action="store_true",
+                        help="skip layouts whose kernels are not traced instead of profiling them")
+    parser.add_argument("--store", type=str, default=None,
+                        help="SQLite result store of earlier predictions")
+    parser.add_argument("--hbm_capacity", type=float, default=None,
+                        help="GB of memory per GPU, layouts exceeding it are rejected")
+    args = parser.parse_args()
+
+    main(args)
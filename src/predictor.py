@@ -1,13 +1,23 @@
 import torch
+import numpy as np
 
 from .model.gpt_model import ShardedGptModel
 
 from .trainer import Trainer
 from .config import vTrainConfig
-from .graph import CommNode, DepGraph, LayerNode, TaskNode
+from .collective import CollectiveModel, fit_alpha_beta, load_allreduce_LUTs
+from .graph import CommNode, DepGraph, GraphBuilder, GraphTopology, LayerNode, StreamingGraph, TaskNode, TopologyCache
+from .placement import Placement, placement_orders
+from .schedule import get_schedule
+from .trace_cache import load_trace_cache, save_trace_cache, source_stamp
+from .trace_parser import parse_trace, parse_trace_file
+from .trace_store import TraceStore
 
 import os
+import copy
+import time
 import logging
+from collections import deque
 
 
 logger = logging.getLogger()
@@ -20,6 +30,49 @@ logging.basicConfig(
 
 model_names = ['bert', 'gpt']
 
+# relative difference of the per-period increments of two consecutive
+# steady-state windows up to which 1F1B pipelines are extrapolated
+extrapolation_tolerance = 0.01
+
+# compiled graph topologies, keyed by vTrain.get_structure_key()
+topology_cache = TopologyCache(max_bytes=2 * 1024 ** 3)
+
+# parsed kernel traces of this process by (trace file, size and mtime),
+# inherited by forked sweep workers (see src/sweep.py)
+kernel_dicts = dict()
+
+
+def keep_kernels(log_filename, kernel_dict):
+    try:
+        save_trace_cache(log_filename, kernel_dict)
+    except OSError as e:
+        logger.warning(f"cannot cache parsed traces of {log_filename}: {e}")
+    kernel_dicts[(os.path.abspath(log_filename), tuple(source_stamp(log_filename).values()))] = kernel_dict
+
+
+def load_traced_kernels(config, num_workers=1):
+    '''
+        parsed kernel traces of ``config``, or None if it is not traced yet;
+            ``config`` may be any object with trace_path and the fields of
+            trace_store.trace_fields
+    '''
+    # traces are keyed by every field affecting the kernel shapes
+    log_filename = TraceStore(config.trace_path).lookup(config)
+    if log_filename is None:
+        return None
+
+    key = (os.path.abspath(log_filename), tuple(source_stamp(log_filename).values()))
+    if key in kernel_dicts:
+        return kernel_dicts[key]
+    kernel_dict = load_trace_cache(log_filename)
+    if kernel_dict is not None:
+        kernel_dicts[key] = kernel_dict
+    else:
+        # parse traces, once per trace file
+        kernel_dict = parse_trace_file(log_filename, num_workers=num_workers)
+        keep_kernels(log_filename, kernel_dict)
+    return kernel_dict
+
 
 class ParamInfo():
     def __init__(self, elem_num, elem_size=2):
@@ -37,10 +90,28 @@ class ParamInfo():
 
 
 class vTrain():
-    def __init__(self, config: vTrainConfig):
-        self.config = config
+    def __init__(self, config: vTrainConfig, keep_kernel_detail: bool = False, trace_workers: int = 1,
+                 result_store=None):
+        # keep one node per GPU kernel in the compact graph (for timeline export)
+        # instead of contracting kernel chains
+        self.keep_kernel_detail = keep_kernel_detail
+        # processes parsing a trace file that is not cached yet
+        self.trace_workers = trace_workers
+        # ResultStore of earlier predictions, consulted by __call__()
+        self.result_store = result_store
 
         self.model = None
+        self.graph = None
+        self.compiled = None
+        self.bubble_fraction = None
+
+        self.cbid_table = None
+        self.set_config(config)
+
+
+    def set_config(self, config: vTrainConfig):
+        self.config = config
+
         self.model_params = {
                                 'embeddings': [
                                     ParamInfo((config.vocab_size // config.tensor_parallel_size) * config.hidden_size),        # word embed
@@ -68,39 +139,289 @@ class vTrain():
                         [('transformer', True) for _ in range(config.num_layers)] + \
                         [('logit', True)]
 
-        self.cbid_table = None
+        self.placement = Placement(config.tensor_parallel_size, config.data_parallel_size,
+                                   config.pipeline_parallel_size, config.node_size, config.placement_order)
         self.allreduce_LUT = self.get_allreduce_LUT()
+        self.collective_model = self.get_collective_model()
+
 
-    def __call__(self):
+    def __call__(self, engine="event"):
         config = self.config
 
         # create model
         # self.create_model()
-        self.graph = DepGraph()
 
         # logger.info(f"dp, tp, pp = {config.data_parallel_size}, {config.tensor_parallel_size}, {config.pipeline_parallel_size}")
         logger.info(config)
-
-        # create layer graph which contains
-        # framework-level information
-        logger.info(f"create graph...")
-        ingredients = self.create_nodes()
-        self.create_layer_graph(ingredients)
+        if not self.fits_in_memory():
+            logger.warning(f"estimated peak memory of {self.get_peak_memory() / (2 ** 30):.1f} GB "
+                           f"exceeds hbm_capacity of {config.hbm_capacity} GB")
+
+        key = self.result_store.key(config, engine) if self.result_store is not None else None
+        if key is not None:
+            stored = self.result_store.get(key)
+            if stored is not None:
+                logger.info(f"reuse stored result...")
+                self.bubble_fraction = stored["bubble_fraction"]
+                return stored["P"], stored["P_brk"]
 
         # collect CUDA runtime and GPU kernel traces
-        # and replace layer nodes to low-level tasks
         logger.info(f"start profiling...")
+        start = time.perf_counter()
         kernel_dict = self.profile()
 
-        # Predict iteration time 
+        if self.use_extrapolation():
+            result, breakdown = self.extrapolate(kernel_dict, config.steady_state_periods, engine=engine)
+        else:
+            result, breakdown = self.simulate(kernel_dict, engine=engine)
+
+        self.bubble_fraction = self.get_bubble_fraction(kernel_dict, result)
+
+        if self.result_store is not None:
+            # the trace exists once profiled
+            key = key or self.result_store.key(config, engine)
+            self.result_store.put(key, config, engine, result, breakdown, self.bubble_fraction,
+                                  time.perf_counter() - start)
+
+        return result, breakdown
+
+
+    def use_extrapolation(self):
+        # the per-period increment is only constant for the 1F1B steady state
+        config = self.config
+        periods = config.steady_state_periods
+        return periods is not None and config.pipeline_scheduling == "1f1b" and \
+                self.get_num_microbatch() > self.get_extrapolation_lengths(self.get_steady_state_periods(periods))[-1]
+
+
+    def get_steady_state_periods(self, periods):
+        # the per-microbatch increment keeps changing for about pp microbatches after the warmup
+        return max(periods, self.config.pipeline_parallel_size)
+
+
+    def get_extrapolation_lengths(self, periods):
+        # microbatches of the warmup followed by ``periods``, 2x and 3x steady-state periods
+        num_warmup = self.config.pipeline_parallel_size - 1
+        return [num_warmup + i * periods for i in range(1, 4)]
+
+
+    def simulate(self, kernel_dict, engine="event", num_microbatch=None):
+        self.compiled = None
+
+        if engine == "streaming":
+            # time nodes while they are created instead of keeping the graph
+            logger.info(f"create graph and predict...")
+            self.graph = StreamingGraph(kernel_dict)
+            ingredients = self.create_nodes()
+            self.create_layer_graph(ingredients, num_microbatch)
+            result, breakdown = self.graph.finish()
+            self.graph = None
+            return result, breakdown
+
+        key = self.get_structure_key(num_microbatch)
+        if self.uses_topology(engine) and key in topology_cache:
+            # only node durations depend on the rest of the config
+            logger.info(f"reuse graph structure...")
+            self.graph_key = key
+        else:
+            # create layer graph which contains
+            # framework-level information
+            logger.info(f"create graph...")
+            self.graph = DepGraph()
+            ingredients = self.create_nodes()
+            self.create_layer_graph(ingredients, num_microbatch)
+
+        # replace layer nodes to low-level tasks
+        # and predict iteration time
         logger.info(f"start prediction...")
-        result, breakdown = self.predict(kernel_dict)
+        result, breakdown = self.predict(kernel_dict, engine=engine)
 
         return result, breakdown
+
+
+    def extrapolate(self, kernel_dict, periods, engine="event"):
+        '''
+            simulate warmup, ``periods`` (at least pipeline_parallel_size), 2x
+                and 3x ``periods`` steady-state 1F1B periods and cooldown, then
+                extend the per-period increment of the makespans of the rank
+                streams and of every breakdown to the full microbatch count;
+                link streams (PP{src}_{dst}) finish as much later as the stream
+                of their sending rank
+            if the increments of the two windows differ by more than
+                extrapolation_tolerance, the pipeline is not in steady state
+                yet and every microbatch is simulated instead
+        '''
+        num_microbatch = self.get_num_microbatch()
+        periods = self.get_steady_state_periods(periods)
+        lengths = self.get_extrapolation_lengths(periods)
+        logger.info(f"extrapolate {num_microbatch} microbatches from {', '.join(map(str, lengths))}")
+
+        results = [self.simulate(kernel_dict, engine, length) for length in lengths]
+        extended = self._extend(results, (num_microbatch - lengths[-1]) / periods)
+        if extended is None:
+            logger.warning(f"no steady state after {lengths[0]} microbatches, simulate all {num_microbatch} "
+                           f"(steady_state_periods={periods})")
+            return self.simulate(kernel_dict, engine)
+
+        return extended
+
+
+    def _extend(self, results, scale):
+        # None unless the increments of consecutive windows agree
+        (P_1, _), (P_2, P_brk_2), (P_3, P_brk_3) = results
+        P = dict()
+        P_brk = dict()
+        for stream in P_3.keys():
+            # the busy time grows by the same work every period on every stream
+            P_brk[stream] = {k: v + (v - P_brk_2[stream][k]) * scale
+                                for k, v in P_brk_3[stream].items()}
+            if stream.startswith("PP"):
+                continue
+            increment, prev_increment = P_3[stream] - P_2[stream], P_2[stream] - P_1[stream]
+            if abs(increment - prev_increment) > extrapolation_tolerance * max(abs(increment), abs(prev_increment)):
+                return None
+            P[stream] = P_3[stream] + increment * scale
+
+        # the last transfer over a link follows the last pass of its sending
+        # rank, the link streams themselves only settle later
+        for stream in P_3.keys():
+            if stream.startswith("PP"):
+                src = f"GPU{stream[len('PP'):].partition('_')[0]}"
+                P[stream] = P_3[stream] + P[src] - P_3[src]
+
+        return P, P_brk
     
 
+    def predict_batch(self, configs):
+        '''
+            predict configs sharing the same graph structure (parallelism
+                layout, see get_structure_key) in one traversal of the graph,
+                with node durations stacked as a (num_nodes, len(configs)) matrix
+            returns a list of (result, breakdown), one per config
+        '''
+        base_config = self.config
+
+        try:
+            layouts = set()
+            config_kernels = []
+            for config in configs:
+                self.set_config(config)
+                layouts.add((self.get_structure_key(), config.steady_state_periods))
+                config_kernels.append(self.profile())
+            if len(layouts) != 1:
+                raise ValueError("predict_batch requires configs sharing the same graph structure")
+
+            config = configs[0]
+            num_microbatch = self.get_num_microbatch()
+            periods = config.steady_state_periods
+            results = None
+            if self.use_extrapolation():
+                periods = self.get_steady_state_periods(periods)
+                lengths = self.get_extrapolation_lengths(periods)
+                windows = [self._simulate_batch(configs, config_kernels, length) for length in lengths]
+                results = [self._extend(config_results, (num_microbatch - lengths[-1]) / periods)
+                            for config_results in zip(*windows)]
+                if any(result is None for result in results):
+                    logger.warning(f"no steady state after {lengths[0]} microbatches, simulate all {num_microbatch} "
+                                   f"(steady_state_periods={periods})")
+                    results = None
+            if results is None:
+                results = self._simulate_batch(configs, config_kernels)
+        finally:
+            # the configs are swapped in while profiling and retiming
+            self.set_config(base_config)
+
+        return results
+
+
+    def search_placement(self, orders=None):
+        '''
+            predict the iteration time of every placement order (default: all)
+                in one batch, as [(iteration time, order)] from the fastest
+            placements share the graph structure, only comm durations differ
+        '''
+        configs = []
+        for order in orders or placement_orders:
+            config = copy.copy(self.config)
+            config.placement_order = order
+            configs.append(config)
+
+        results = self.predict_batch(configs)
+        return sorted((max(result.values()), config.placement_order)
+                        for config, (result, _) in zip(configs, results))
+
+
+    def _simulate_batch(self, configs, config_kernels, num_microbatch=None):
+        self.set_config(configs[0])
+        key = self.get_structure_key(num_microbatch)
+        if key not in topology_cache:
+            logger.info(f"create graph...")
+            self.graph = DepGraph()
+            self.create_layer_graph(self.create_nodes(), num_microbatch)
+        self.graph_key = key
+        topology = self.get_topology()
+
+        durations = []
+        gaps = []
+        for config, kernel_dict in zip(configs, config_kernels):
+            self.set_config(config)
+            duration, gap = self.compute_durations(topology, kernel_dict)
+            durations.append(duration)
+            gaps.append(gap)
+
+        logger.info(f"start prediction of {len(configs)} configs...")
+        self.compiled = topology.retime(np.stack(durations, axis=1), np.stack(gaps, axis=1))
+        makespan, compute, comm = self._solve_numpy(self.compiled)
+
+        return [self._to_result(self.compiled.streams, makespan[:, k], compute[:, k], comm[:, k])
+                    for k in range(len(configs))]
+
+
+    def retime(self, config: vTrainConfig, engine="numpy"):
+        '''
+            predict ``config`` reusing the graph structure of earlier
+                simulations of this instance, so that only node durations
+                are recomputed (e.g. for other bandwidths or GPU)
+            falls back to building the graph when the structure differs
+                or the engine works on the object graph
+        '''
+        self.set_config(config)
+        return self(engine=engine)
+
+
+    def uses_topology(self, engine):
+        return engine in ["compact", "numpy"] and not self.keep_kernel_detail
+
+
+    def get_structure_key(self, num_microbatch=None):
+        # config fields that determine the topology of the dependency graph,
+        # everything else only changes node durations
+        config = self.config
+        if num_microbatch is None:
+            num_microbatch = self.get_num_microbatch()
+        buckets = None
+        if config.data_parallel_size > 1 and config.use_gradient_bucket and config.data_parallel_mode != "fsdp":
+            # layers completing every bucket
+            buckets = tuple(tuple(layer_nums[-1] for layer_nums in self.compute_bucket_assignment(rank)[1])
+                                for rank in range(config.pipeline_parallel_size))
+        return (config.num_layers,
+                config.pipeline_parallel_size,
+                config.data_parallel_size > 1,
+                buckets,
+                config.tensor_parallel_size > 1,
+                num_microbatch,
+                config.use_checkpoint,
+                config.pipeline_scheduling,
+                config.virtual_pipeline_size,
+                config.data_parallel_mode,
+                config.fsdp_prefetch_depth if config.data_parallel_mode == "fsdp" else None,
+                config.comm_sm_contention > 0)
+
+
     def show_graph(self):
-        if self.graph is None:
+        if self.compiled is not None:
+            self.compiled.to_depgraph().show_graph()
+        elif self.graph is None:
             logger.error(f"there is no simulated execution graph")
         else:
             self.graph.show_graph()
@@ -113,6 +434,7 @@ class vTrain():
         self.model = ShardedGptModel(num_layers=1,
                                      hidden_size=config.hidden_size,
                                      world_size=config.tensor_parallel_size,
+                                     vocab_size=config.vocab_size,
                                      num_attention_heads=config.num_attention_heads,
                                      max_sequence_length=config.max_length)
 
@@ -121,7 +443,7 @@ class vTrain():
 
     def create_nodes(self):
         layers = self.layers
-        ingredients = {"fwd": {}, "bwd": {}, "wu": {}}
+        ingredients = {"fwd": {}, "bwd": {}, "bwd_input": {}, "bwd_weight": {}, "wu": {}}
 
         # forward functions
         for layer_num, (layer_name, _) in enumerate(layers):
@@ -138,6 +460,10 @@ class vTrain():
             bwdNode = (layer_num, layer_name, f"Bwd_{layer_name}", "GPU0")
             ingredients["bwd"][layer_num] = bwdNode
 
+            # backward split into input and weight gradients
+            ingredients["bwd_input"][layer_num] = (layer_num, layer_name, f"BwdI_{layer_name}", "GPU0")
+            ingredients["bwd_weight"][layer_num] = (layer_num, layer_name, f"BwdW_{layer_name}", "GPU0")
+
         # weight update functions
         for layer_num, (layer_name, requires_grad) in enumerate(layers):
             if not requires_grad:
@@ -148,213 +474,670 @@ class vTrain():
         return ingredients
     
 
-    def _compute_p2p_latency(self,
-                             data_size,     # data_size in Bytes
-                             bandwidth):    # bandwidth in Gbps
-        # simple latency-bandwidth model
-        bytes_per_sec = bandwidth * (2 ** 30) / 8
-        latency_sec = data_size / (bytes_per_sec / 4)
-        latency_nano_sec = latency_sec * (10 ** 9)
-        return latency_nano_sec
-    
-
-    def create_layer_graph(self, ingredients):
+    def get_feature_map_size(self):
         config = self.config
-        graph = self.graph
-        nodes_by_layer = [{"fwd": None, "bwd": None, "wu": None}
-                            for _ in range(len(self.layers)+1)]
-        graph.create_stream("Comm")
+        data_size = 2   # bytes
+        return config.micro_batch_size * config.max_length * config.hidden_size * data_size
 
-        dp, tp, pp = config.data_parallel_size, config.tensor_parallel_size, config.pipeline_parallel_size
 
-        # create streams
-        for gpu_num in range(pp):
-            graph.create_stream(f"GPU{gpu_num}")
-        graph.create_stream("Comm")
+    def get_layer_idx_by_stage(self):
+        num_stages = self.config.pipeline_parallel_size * self.config.virtual_pipeline_size
 
         # balacne
-        balance = [config.num_layers // pp for _ in range(pp)]
+        balance = [self.config.num_layers // num_stages for _ in range(num_stages)]
         balance[0] += 1     # embedding
         balance[-1] += 1    # logit
-        num_layers = sum(balance)
 
-        layer_idx_by_rank = []
+        layer_idx_by_stage = []
         idx = 0
         for n in balance:
             idx_list = list(range(idx, idx+n))
-            layer_idx_by_rank.append(idx_list)
+            layer_idx_by_stage.append(idx_list)
             idx = idx_list[-1] + 1
 
-        num_microbatch = (config.global_batch_size // dp) // config.micro_batch_size
+        return layer_idx_by_stage
+
+
+    def get_layer_idx_by_rank(self):
+        # stage ``chunk * pp + rank`` is placed on ``rank``
+        pp = self.config.pipeline_parallel_size
+        layer_idx_by_stage = self.get_layer_idx_by_stage()
+        return [sum(layer_idx_by_stage[rank::pp], []) for rank in range(pp)]
 
-        self.nodes_by_microbatch = [[] for _ in range(num_microbatch)]
-        nodes_by_microbatch = self.nodes_by_microbatch
+
+    def get_pp_links(self):
+        # (rank, rank of the next stage) for every pair of adjacent stages
+        pp = self.config.pipeline_parallel_size
+        num_stages = pp * self.config.virtual_pipeline_size
+        links = []
+        for stage in range(num_stages - 1):
+            link = (stage % pp, (stage+1) % pp)
+            if link[0] != link[1] and link not in links:
+                links.append(link)
+        return links
+
+
+    def get_schedule(self, num_microbatch=None):
+        config = self.config
+        if num_microbatch is None:
+            num_microbatch = self.get_num_microbatch()
+        return get_schedule(config.pipeline_scheduling, config.pipeline_parallel_size,
+                            num_microbatch, config.virtual_pipeline_size)
+
+
+    def get_bubble_fraction(self, kernel_dict, result):
+        '''
+            fraction of the iteration time pipeline ranks are idle on average,
+                i.e. 1 - (work of the rank) / (iteration time), where the work
+                are the kernels and collectives the rank runs for every
+                microbatch plus gradient synchronization and weight update
+        '''
+        work = self.get_work_by_rank(kernel_dict)
+        iter_time = max(result.values())
+        return 1 - sum(work) / (len(work) * iter_time)
+
+
+    def get_kernel_time(self, kernel_dict, function):
+        # duration of a layer node, its kernels and the gaps between them
+        nodeInfo = kernel_dict.get(function, [])
+        return sum(info[0] for info in nodeInfo) + sum(info[-1] for info in nodeInfo[:-1])
+
+
+    def get_forward_time_by_stage(self, kernel_dict):
+        # forward pass of one microbatch through every stage, with its tensor-parallel collectives
+        tp_time = self.compute_tp_comm_time(self.get_feature_map_size()) if self.config.tensor_parallel_size > 1 else 0.
+        forward_time = []
+        for layer_idx_list in self.get_layer_idx_by_stage():
+            t = 0.
+            for layer_idx in layer_idx_list:
+                layer_name, _ = self.layers[layer_idx]
+                t += self.get_kernel_time(kernel_dict, f"Fwd_{layer_name}")
+                if layer_name in ["encoder", "transformer"]:
+                    t += 2 * tp_time
+            forward_time.append(t)
+        return forward_time
+
+
+    def get_work_by_rank(self, kernel_dict):
+        '''
+            time every pipeline rank spends on its compute stream: kernels and
+                (blocking) tensor-parallel collectives of every microbatch,
+                gradient synchronization which is not overlapped and weight update
+        '''
+        config = self.config
+        dp, tp, pp = config.data_parallel_size, config.tensor_parallel_size, config.pipeline_parallel_size
+        num_microbatch = self.get_num_microbatch()
+        layer_idx_by_stage = self.get_layer_idx_by_stage()
+        num_stages = len(layer_idx_by_stage)
+        kernel_time = lambda function: self.get_kernel_time(kernel_dict, function)
+        backward = ["BwdI", "BwdW"] if self.get_schedule().split_backward else ["Bwd"]
+
+        tp_time = self.compute_tp_comm_time(self.get_feature_map_size()) if tp > 1 else 0.
+
+        work = [0.] * pp
+        for stage, layer_idx_list in enumerate(layer_idx_by_stage):
+            rank = stage % pp
+            microbatch_work = kernel_time("Fwd_loss") if stage == num_stages - 1 else 0.
+            for layer_idx in layer_idx_list:
+                layer_name, _ = self.layers[layer_idx]
+                microbatch_work += kernel_time(f"Fwd_{layer_name}")
+                microbatch_work += sum(kernel_time(f"{kind}_{layer_name}") for kind in backward)
+                if config.use_checkpoint and stage < num_stages - 1:
+                    microbatch_work += kernel_time(f"Fwd_{layer_name}")
+                if layer_name in ["encoder", "transformer"]:
+                    microbatch_work += 4 * tp_time
+                work[rank] += kernel_time(f"WU_{layer_name}")
+            work[rank] += num_microbatch * microbatch_work
+
+        # bucketed and sharded gradient collectives run on their own stream
+        if dp > 1 and not config.use_gradient_bucket and config.data_parallel_mode != "fsdp":
+            collective = "allreduce" if config.data_parallel_mode in ["ddp", "zero1"] else "reducescatter"
+            for rank, size in enumerate(self.get_param_size_by_rank()):
+                work[rank] += self.compute_dp_comm_time(size, collective)
+
+        return work
+
+
+    def get_lower_bound(self, kernel_dict):
+        '''
+            lower bound of the iteration time, without building the graph:
+                rank r starts once the first microbatch passed the forward
+                passes (and transfers) of the r stages before it, it is then
+                busy with its work (get_work_by_rank), after which ZeRO-1/2
+                still gather the updated parameters
+        '''
+        config = self.config
+        pp = config.pipeline_parallel_size
+        feature_map_size = self.get_feature_map_size()
+        forward_time = self.get_forward_time_by_stage(kernel_dict)
+
+        work = self.get_work_by_rank(kernel_dict)
+        if config.data_parallel_size > 1 and config.data_parallel_mode in ["zero1", "zero2"]:
+            work = [w + self.compute_dp_comm_time(size, "allgather")
+                        for w, size in zip(work, self.get_param_size_by_rank())]
+
+        bound = 0.
+        start = 0.
+        for rank in range(pp):
+            bound = max(bound, start + work[rank])
+            if rank < pp - 1:
+                start += forward_time[rank] + self.compute_p2p_time(feature_map_size, rank, rank + 1)
+        return bound
+
+
+    def get_activation_size(self, layer_name, checkpointed=False):
+        '''
+            bytes of activations a layer keeps per microbatch for its backward
+                pass, in fp16 without sequence parallelism (Korthikanti et al.,
+                Reducing Activation Recomputation in Large Transformer Models);
+                a checkpointed layer only keeps its input
+        '''
+        config = self.config
+        s, b, h = config.max_length, config.micro_batch_size, config.hidden_size
+        a, t, v = config.num_attention_heads, config.tensor_parallel_size, config.vocab_size
+        if layer_name in ["encoder", "transformer"]:
+            if checkpointed:
+                return 2 * s * b * h
+            return s * b * h * (10 + 24 / t) + 5 * a * s * s * b / t
+        if layer_name == "embeddings":
+            # token ids and the dropout mask of the embeddings
+            return 8 * s * b if checkpointed else 8 * s * b + s * b * h
+        # logit: input, fp16 logits and fp32 softmax of the cross-entropy loss
+        return 2 * s * b * h + 6 * s * b * v / t
+
+
+    def get_weight_input_size(self, layer_name):
+        # bytes of the inputs of the weight GEMMs of a layer, kept from its
+        # input gradient to its weight gradient pass if the backward is split
+        config = self.config
+        s, b, h = config.max_length, config.micro_batch_size, config.hidden_size
+        t = config.tensor_parallel_size
+        if layer_name in ["encoder", "transformer"]:
+            # qkv and up projection inputs, attention output and gelu output
+            return s * b * h * (4 + 10 / t)
+        if layer_name == "embeddings":
+            return 8 * s * b
+        return 2 * s * b * h
+
+
+    def get_memory_by_rank(self):
+        '''
+            peak memory of a GPU of every pipeline rank in bytes, as a dict of
+                "parameters", "gradients", "optimizer", "activations",
+                "microbatches_in_flight" and "total"
+            mixed precision: fp16 parameters and gradients, FusedAdam keeps fp32
+                master parameters, momentum and variance; ZeRO-1 shards the
+                optimizer states over the dp ranks, ZeRO-2 also the gradients
+                and FSDP also the parameters, of which it gathers
+                fsdp_prefetch_depth + 1 layers at once
+            activations are kept from the forward to the backward pass of a
+                microbatch, in the pass order of the pipeline schedule (split
+                backward passes keep the inputs of the weight GEMMs until the
+                weight gradient pass), plus the full activations of one layer
+                while a checkpointed layer is recomputed
+        '''
+        config = self.config
+        dp = config.data_parallel_size
+        mode = config.data_parallel_mode
+        schedule = self.get_schedule()
+        layer_idx_by_stage = self.get_layer_idx_by_stage()
+        num_stages = len(layer_idx_by_stage)
+
+        # the last stage does not recompute
+        checkpointed = [config.use_checkpoint and stage < num_stages - 1 for stage in range(num_stages)]
+        stage_activation = [sum(self.get_activation_size(self.layers[layer_idx][0], checkpointed[stage])
+                                    for layer_idx in layer_idx_list)
+                                for stage, layer_idx_list in enumerate(layer_idx_by_stage)]
+        stage_weight_input = [sum(self.get_weight_input_size(self.layers[layer_idx][0]) for layer_idx in layer_idx_list)
+                                for layer_idx_list in layer_idx_by_stage]
+
+        memory_by_rank = []
+        for rank, layer_nums in enumerate(self.get_layer_idx_by_rank()):
+            layer_numel = [sum(p.numel() for p in self.model_params[self.layers[layer_num][0]]) for layer_num in layer_nums]
+            numel = sum(layer_numel)
+            parameters = 2 * numel
+            gradients = 2 * numel
+            optimizer = 12 * numel
+            if dp > 1 and mode != "ddp":
+                optimizer /= dp
+            if dp > 1 and mode in ["zero2", "fsdp"]:
+                gradients /= dp
+            if dp > 1 and mode == "fsdp":
+                # gathered parameters and the unsharded gradients of a layer
+                gathered = min(config.fsdp_prefetch_depth + 1, len(layer_nums))
+                parameters = parameters / dp + gathered * 2 * max(layer_numel)
+                gradients += 2 * max(layer_numel)
+
+            activations = 0.
+            peak_activations = 0.
+            in_flight = 0
+            peak_in_flight = 0
+            for kind, _, chunk in schedule.rank_passes(rank):
+                stage = schedule.stage(rank, chunk)
+                if kind == "F":
+                    activations += stage_activation[stage]
+                    in_flight += 1
+                elif kind == "B":
+                    activations -= stage_activation[stage]
+                    if schedule.split_backward:
+                        activations += stage_weight_input[stage]
+                    else:
+                        in_flight -= 1
+                else:
+                    activations -= stage_weight_input[stage]
+                    in_flight -= 1
+                peak_activations = max(peak_activations, activations)
+                peak_in_flight = max(peak_in_flight, in_flight)
+            recomputed = [self.get_activation_size(self.layers[layer_idx][0])
+                            for chunk in range(config.virtual_pipeline_size)
+                            if checkpointed[schedule.stage(rank, chunk)]
+                            for layer_idx in layer_idx_by_stage[schedule.stage(rank, chunk)]]
+            activations = peak_activations + max(recomputed, default=0.)
+
+            memory_by_rank.append({"parameters": parameters,
+                                   "gradients": gradients,
+                                   "optimizer": optimizer,
+                                   "activations": activations,
+                                   "microbatches_in_flight": peak_in_flight,
+                                   "total": parameters + gradients + optimizer + activations})
+
+        return memory_by_rank
+
+
+    def get_peak_memory(self):
+        return max(memory["total"] for memory in self.get_memory_by_rank())
+
+
+    def fits_in_memory(self):
+        # whether every GPU fits its HBM capacity, if the config sets one
+        capacity = self.config.hbm_capacity
+        return capacity is None or self.get_peak_memory() <= capacity * (2 ** 30)
+
+
+    def get_param_size_by_rank(self):
+        param_size_by_rank = []
+        for layer_nums in self.get_layer_idx_by_rank():
+            size = 0
+            for layer_num in layer_nums:
+                layer_name, _ = self.layers[layer_num]
+                for p in self.model_params[layer_name]:
+                    size += p.numel() * p.element_size()
+            param_size_by_rank.append(size)
+
+        return param_size_by_rank
+
+
+    def get_layer_param_size(self, layer_num):
+        layer_name, _ = self.layers[layer_num]
+        return sum(p.numel() * p.element_size() for p in self.model_params[layer_name])
+
+
+    def get_dp_comm_sizes_by_rank(self):
+        '''
+            sizes of the data-parallel collectives of every pipeline rank,
+                as {function: [size of bucket 0, size of bucket 1, ...]}
+        '''
+        config = self.config
+        mode = config.data_parallel_mode
+        sizes_by_rank = []
+        for rank, param_size in enumerate(self.get_param_size_by_rank()):
+            sizes = dict()
+            if mode == "fsdp":
+                layer_sizes = [self.get_layer_param_size(layer_num) for layer_num in self.get_layer_idx_by_rank()[rank]]
+                sizes["allgather_dp"] = layer_sizes
+                sizes["reducescatter_dp"] = layer_sizes
+            else:
+                grad_sizes = self.compute_bucket_assignment(rank)[0] if config.use_gradient_bucket else [param_size]
+                sizes["allreduce_dp" if mode in ["ddp", "zero1"] else "reducescatter_dp"] = grad_sizes
+                if mode != "ddp":
+                    sizes["allgather_dp"] = [param_size]
+            sizes_by_rank.append(sizes)
+
+        return sizes_by_rank
+
+
+    def get_num_microbatch(self):
+        config = self.config
+        return (config.global_batch_size // config.data_parallel_size) // config.micro_batch_size
+
+
+    def create_layer_graph(self, ingredients, num_microbatch=None):
+        config = self.config
+        graph = self.graph
+        nodes_by_layer = [{"fwd": None, "bwd": None, "wu": None}
+                            for _ in range(len(self.layers)+1)]
+
+        dp, tp, pp = config.data_parallel_size, config.tensor_parallel_size, config.pipeline_parallel_size
+
+        # create streams: compute and one stream per collective type of every rank
+        for gpu_num in range(pp):
+            graph.create_stream(f"GPU{gpu_num}")
+        if tp > 1:
+            for gpu_num in range(pp):
+                graph.create_stream(f"TP{gpu_num}")
+        if dp > 1:
+            for gpu_num in range(pp):
+                graph.create_stream(f"DP{gpu_num}")
+
+        # one stream per direction of the link between the ranks of adjacent stages
+        for src, dst in self.get_pp_links():
+            graph.create_stream(f"PP{src}_{dst}")
+            graph.create_stream(f"PP{dst}_{src}")
+
+        layer_idx_by_rank = self.get_layer_idx_by_rank()
+        num_layers = sum(len(idx_list) for idx_list in layer_idx_by_rank)
+
+        if num_microbatch is None:
+            num_microbatch = self.get_num_microbatch()
+        self.graph_key = self.get_structure_key(num_microbatch)
+
+        # nodes of a microbatch are chained in creation order
+        for microbatch_idx in range(num_microbatch):
+            graph.create_group(microbatch_idx)
         
-        local_batch_size = config.micro_batch_size
-        data_size = 2   # bytes
-        feature_map_size = local_batch_size * config.max_length * config.hidden_size * data_size
+        feature_map_size = self.get_feature_map_size()
+
+        schedule = self.get_schedule(num_microbatch)
+        layer_idx_by_stage = self.get_layer_idx_by_stage()
+        num_stages = schedule.num_stages()
+
+        # gradient collectives (DDP/ZeRO buckets or FSDP layer shards) run on a dp
+        # stream of every rank as soon as the last microbatch computed the
+        # gradients of their first layer
+        mode = config.data_parallel_mode
+        use_fsdp = dp > 1 and mode == "fsdp"
+        use_bucket = dp > 1 and (config.use_gradient_bucket or use_fsdp)
+        grad_kind = "W" if schedule.split_backward else "B"
+        grad_comm_by_layer = dict()
+        fsdp_shards = dict()
+        if use_fsdp:
+            # FSDP gathers the parameters of a layer before its forward and backward
+            # (recomputation) passes and reduce-scatters its gradients
+            gathered = [deque(maxlen=config.fsdp_prefetch_depth + 1) for _ in range(pp)]
+            for rank in range(pp):
+                for idx, layer_idx in enumerate(layer_idx_by_rank[rank]):
+                    fsdp_shards[layer_idx] = (idx, self.get_layer_param_size(layer_idx))
+                    grad_comm_by_layer[layer_idx] = [("reducescatter_dp", idx, fsdp_shards[layer_idx][1])]
+        elif use_bucket:
+            function = "allreduce_dp" if mode in ["ddp", "zero1"] else "reducescatter_dp"
+            for rank in range(pp):
+                bucket_sizes, bucket_indices = self.compute_bucket_assignment(rank)
+                for bucket_idx, (size, layer_nums) in enumerate(zip(bucket_sizes, bucket_indices)):
+                    grad_comm_by_layer.setdefault(layer_nums[-1], []).append((function, bucket_idx, size))
 
-        # warmup phase
-        num_warmup_microbatch_rank0 = min(pp - 1, num_microbatch)
-        for microbatch_idx in range(num_warmup_microbatch_rank0):
-            for rank in range(pp - 1 - microbatch_idx):
-                for layer_idx in layer_idx_by_rank[rank]:
+        for rank, kind, microbatch_idx, chunk in schedule.order():
+            stage = schedule.stage(rank, chunk)
+
+            # Fwd nodes
+            if kind == "F":
+                for layer_idx in layer_idx_by_stage[stage]:
                     nodeInfo = ingredients["fwd"][layer_idx]
                     node = LayerNode(*nodeInfo)
                     node.stream = f"GPU{rank}"
 
-                    graph.add_node(node)
-                    nodes_by_microbatch[microbatch_idx].append(node)
+                    prev = [self._add_fsdp_gather(rank, fsdp_shards[layer_idx], gathered[rank])] if use_fsdp else []
+                    graph.add_node(node, prev=prev)
+                    graph.add_to_group(microbatch_idx, node)
+                    if use_fsdp:
+                        gathered[rank].append(node)
 
                     # comm across mp
                     if tp > 1 and nodeInfo[1] in ["encoder", "transformer"]:
-                        self._add_tp_communication(rank, tp, microbatch_idx, feature_map_size)
-                        self._add_tp_communication(rank, tp, microbatch_idx, feature_map_size)
-                    
-                # pipeline inter-stream gap
-                pp_gap = self._compute_p2p_latency(2*feature_map_size, config.inter_node_bandwidth)
-                graph.streams[f"GPU{rank}"][-1].gap += pp_gap
-
-        # 1F1B phase + cooldown phase
-        for microbatch_idx in range(num_microbatch):
-            for rank in range(pp-1, -1, -1):
-                fwd_microbatch_idx = pp - rank - 1 + microbatch_idx
-                bwd_microbatch_idx = microbatch_idx
-
-                # Fwd nodes
-                if fwd_microbatch_idx < num_microbatch:
-                    for layer_idx in layer_idx_by_rank[rank]:
-                        nodeInfo = ingredients["fwd"][layer_idx]
-                        node = LayerNode(*nodeInfo)
-                        node.stream = f"GPU{rank}"
-
-                        graph.add_node(node)
-                        nodes_by_microbatch[fwd_microbatch_idx].append(node)
-
-                        # comm across mp
-                        if tp > 1 and nodeInfo[1] in ["encoder", "transformer"]:
-                            self._add_tp_communication(rank, tp, fwd_microbatch_idx, feature_map_size)
-                            self._add_tp_communication(rank, tp, fwd_microbatch_idx, feature_map_size)
-
-                    # comm across pp
-                    if rank < pp - 1:
-                        pp_gap = self._compute_p2p_latency(2*feature_map_size, config.inter_node_bandwidth)
-                        graph.streams[f"GPU{rank}"][-1].gap += pp_gap
-                        
-                    # loss node
-                    if rank == pp - 1:
-                        nodeInfo = ingredients["fwd"][num_layers]
-                        node = LayerNode(*nodeInfo)
-                        node.stream = f"GPU{rank}"
-
-                        graph.add_node(node)
-                        nodes_by_microbatch[fwd_microbatch_idx].append(node)
-
-                # Bwd nodes + recomputation
+                        self._add_tp_communication(rank, microbatch_idx, feature_map_size)
+                        self._add_tp_communication(rank, microbatch_idx, feature_map_size)
+
+                # comm across pp
+                if stage < num_stages - 1:
+                    self._add_pp_communication(rank, (stage+1) % pp, microbatch_idx, feature_map_size)
+
+                # loss node
+                if stage == num_stages - 1:
+                    nodeInfo = ingredients["fwd"][num_layers]
+                    node = LayerNode(*nodeInfo)
+                    node.stream = f"GPU{rank}"
+
+                    graph.add_node(node)
+                    graph.add_to_group(microbatch_idx, node)
+
+            # Bwd nodes + recomputation
+            elif kind == "B":
                 if config.use_checkpoint:
-                    for layer_idx in reversed(layer_idx_by_rank[rank]):
-                        if rank < pp - 1:   # Last rank worker dosen't perform recomputation
+                    for layer_idx in reversed(layer_idx_by_stage[stage]):
+                        if stage < num_stages - 1:   # Last stage dosen't perform recomputation
                             recompNodeInfo = ingredients["fwd"][layer_idx]
                             recompNode = LayerNode(*recompNodeInfo)
                             recompNode.stream = f"GPU{rank}"
-                            graph.add_node(recompNode)
 
-                for layer_idx in reversed(layer_idx_by_rank[rank]):
-                    nodeInfo = ingredients["bwd"][layer_idx]
+                            prev = [self._add_fsdp_gather(rank, fsdp_shards[layer_idx], gathered[rank])] if use_fsdp else []
+                            graph.add_node(recompNode, prev=prev)
+                            if use_fsdp:
+                                gathered[rank].append(recompNode)
+
+                # parameters gathered for recomputation are kept for the backward pass
+                gather_bwd = use_fsdp and not (config.use_checkpoint and stage < num_stages - 1)
+                bwd = "bwd_input" if schedule.split_backward else "bwd"
+                grad_nodes = []
+                for layer_idx in reversed(layer_idx_by_stage[stage]):
+                    nodeInfo = ingredients[bwd][layer_idx]
                     node = LayerNode(*nodeInfo)
                     node.stream = f"GPU{rank}"
 
-                    graph.add_node(node)
-                    nodes_by_microbatch[bwd_microbatch_idx].append(node)
+                    prev = [self._add_fsdp_gather(rank, fsdp_shards[layer_idx], gathered[rank])] if gather_bwd else []
+                    graph.add_node(node, prev=prev)
+                    graph.add_to_group(microbatch_idx, node)
+                    if gather_bwd:
+                        gathered[rank].append(node)
 
                     # comm across mp
                     if tp > 1 and nodeInfo[1] in ["encoder", "transformer"]:
-                        self._add_tp_communication(rank, tp, bwd_microbatch_idx, feature_map_size)
-                        self._add_tp_communication(rank, tp, bwd_microbatch_idx, feature_map_size)
-                    
-                if rank > 0:
-                    pp_gap = self._compute_p2p_latency(2*feature_map_size, config.inter_node_bandwidth)
-                    graph.streams[f"GPU{rank}"][-1].gap += pp_gap
+                        self._add_tp_communication(rank, microbatch_idx, feature_map_size)
+                        self._add_tp_communication(rank, microbatch_idx, feature_map_size)
+
+                    if use_bucket and grad_kind == "B" and microbatch_idx == num_microbatch - 1:
+                        grad_nodes.append((layer_idx, node))
+
+                # comm across pp
+                if stage > 0:
+                    self._add_pp_communication(rank, (stage-1) % pp, microbatch_idx, feature_map_size)
+
+                # comm across dp, issued once the pass is fully described
+                for layer_idx, node in grad_nodes:
+                    for function, idx, size in grad_comm_by_layer.get(layer_idx, []):
+                        comm_node = self._add_dp_communication(rank, function, idx, size, [node])
+                        self._add_sm_contention(rank, comm_node)
+
+            # weight gradient nodes, nothing across stages depends on them
+            else:
+                for layer_idx in reversed(layer_idx_by_stage[stage]):
+                    nodeInfo = ingredients["bwd_weight"][layer_idx]
+                    node = LayerNode(*nodeInfo)
+                    node.stream = f"GPU{rank}"
+
+                    graph.add_node(node)
+
+                    # comm across dp
+                    if use_bucket and microbatch_idx == num_microbatch - 1:
+                        for function, idx, size in grad_comm_by_layer.get(layer_idx, []):
+                            comm_node = self._add_dp_communication(rank, function, idx, size, [node])
+                            self._add_sm_contention(rank, comm_node)
         
-        param_size_by_rank = [0 for _ in range(pp)]
-        for rank, layer_nums in enumerate(layer_idx_by_rank):
-            size = 0
-            for layer_num in layer_nums:
-                layer_name, _ = self.layers[layer_num]
-                for p in self.model_params[layer_name]:
-                    size += p.numel() * p.element_size()
-            param_size_by_rank[rank] = size
+        param_size_by_rank = self.get_param_size_by_rank()
 
-        # comm across dp
-        if dp > 1:
+        # comm across dp, all at once after the backward pass
+        if dp > 1 and not use_bucket:
             if pp > 1:
-                last_bwd = [self.graph.streams["GPU0"][-1]]
+                last_bwd = [graph.last_node("GPU0")]
             else:
                 last_bwd = []
 
+            function = "allreduce_dp" if mode in ["ddp", "zero1"] else "reducescatter_dp"
             for rank in range(pp):
-                comm_node = CommNode(param_size_by_rank[rank], "Comm")
-                if tp < config.node_size:  # intra-node grad allreduce for dp
-                    comm_node.duration = self.compute_comm_time(comm_node.bucket_size, dp)
-                else:
-                    comm_node.duration = comm_node.bucket_size / (config.inter_node_bandwidth * (2 ** 30) / 8) \
-                                            * (2*(dp-1)/dp) * (10 ** 9)
-                self.graph.add_node(comm_node, prev=last_bwd)
-                self.graph.append_node_to_stream(comm_node, f"GPU{rank}")
+                comm_node = self._add_dp_communication(rank, function, 0, param_size_by_rank[rank],
+                                                       last_bwd + [graph.last_node(f"GPU{rank}")])
+                graph.add_fence(f"GPU{rank}", comm_node)
 
         # optimizer step
-        last_nodes = [nodes[-1] for nodes in graph.streams.values() if nodes]
+        last_nodes = graph.last_nodes()
         for rank in range(pp):
             for layer_idx in layer_idx_by_rank[rank]:
                 nodeInfo = ingredients["wu"][layer_idx]
                 node = LayerNode(*nodeInfo)
                 node.stream = f"GPU{rank}"
 
-                graph.add_node(node)
-                
-                for u in last_nodes:
-                    u.add_dependency(node)
+                graph.add_node(node, prev=last_nodes)
 
-        for stream, nodes in graph.streams.items():
-            if stream == "Comm":
-                continue
-            for i in range(len(nodes)-1):
-                nodes[i].add_dependency(nodes[i+1])
+            # ZeRO-1/2 gather the parameters updated by every shard
+            if dp > 1 and mode in ["zero1", "zero2"]:
+                self._add_dp_communication(rank, "allgather_dp", 0, param_size_by_rank[rank], [node])
+
+        # chain linked streams and microbatches
+        graph.link()
 
-        for nodes in nodes_by_microbatch:
-            for i in range(len(nodes)-1):
-                nodes[i].add_dependency(nodes[i+1])
 
+    def _add_tp_communication(self, rank, microbatch_idx, feature_map_size):
+        # tensor-parallel allreduces block the compute stream of the rank
+        comm_node = CommNode(feature_map_size, f"TP{rank}", "allreduce_tp")
+        comm_node.duration = self.compute_tp_comm_time(comm_node.bucket_size)
+        self.graph.add_node(comm_node, prev=[self.graph.last_node(f"GPU{rank}")])
+        self.graph.add_to_group(microbatch_idx, comm_node)
+        self.graph.add_fence(f"GPU{rank}", comm_node)
 
-    def _add_tp_communication(self, rank, mp, microbatch_idx, feature_map_size):
-        comm_node = CommNode(feature_map_size, "Comm")
-        comm_node.duration = self.compute_comm_time(comm_node.bucket_size, mp)
+
+    def _add_pp_communication(self, rank, peer, microbatch_idx, feature_map_size):
+        # activations (gradients) are sent over the link to the rank of the next
+        # (previous) stage once the pass produced them; only the consuming pass
+        # of the microbatch waits for the transfer, not the sending rank
+        if rank == peer:
+            return
+        comm_node = CommNode(feature_map_size, f"PP{rank}_{peer}", "p2p_pp")
+        comm_node.duration = self.compute_p2p_time(comm_node.bucket_size, rank, peer)
         self.graph.add_node(comm_node)
-        self.graph.append_node_to_stream(comm_node, f"GPU{rank}")
-        self.nodes_by_microbatch[microbatch_idx].append(comm_node)
+        self.graph.add_to_group(microbatch_idx, comm_node)
+
+
+    def _add_dp_communication(self, rank, function, bucket_idx, bucket_size, prev):
+        # ``bucket_idx`` indexes get_dp_comm_sizes_by_rank()[rank][function]
+        comm_node = CommNode(bucket_size, f"DP{rank}", function)
+        comm_node.bucket_idx = bucket_idx
+        comm_node.duration = self.compute_dp_comm_time(bucket_size, function[:-len("_dp")])
+        self.graph.add_node(comm_node, prev=prev)
+        return comm_node
+
+
+    def _add_fsdp_gather(self, rank, shard, gathered):
+        # prefetch: the gather is issued once the compute node
+        # fsdp_prefetch_depth + 1 positions before the gathering one finished
+        idx, size = shard
+        prev = [gathered[0]] if len(gathered) == gathered.maxlen else []
+        comm_node = self._add_dp_communication(rank, "allgather_dp", idx, size, prev)
+        if prev:
+            self._add_sm_contention(rank, comm_node)
+        return comm_node
+
+
+    def _add_sm_contention(self, rank, comm_node):
+        # compute overlapping an asynchronous collective is slowed down by the
+        # SMs running it, charged to the compute stream where it is issued
+        if self.config.comm_sm_contention <= 0:
+            return
+        node = LayerNode(-1, "contention", "sm_contention", f"GPU{rank}")
+        node.duration = self.config.comm_sm_contention * comm_node.duration
+        node.contended = comm_node
+        self.graph.add_node(node)
 
 
     def profile(self):
         config = self.config
-        
-        # collect traces
-        log_filename = os.path.join(config.trace_path,
-                                    f"trace_{config.hidden_size}_{config.tensor_parallel_size}_{config.micro_batch_size}")
-        if os.path.isfile(log_filename):
-            with open(log_filename, "r") as f:
-                traces = f.readlines()
-        else:
+
+        # functions are added or replaced below, the kernels are shared
+        kernel_dict = dict(self.load_kernels())
+
+        if self.get_schedule().split_backward:
+            self.split_backward_kernels(kernel_dict)
+        if config.data_parallel_mode != "ddp":
+            self.shard_optimizer_kernels(kernel_dict)
+
+        return kernel_dict
+
+
+    def load_kernels(self):
+        '''
+            parsed kernel traces of this config, profiled if not traced yet
+                and kept for the rest of the process (see kernel_dicts)
+        '''
+        config = self.config
+
+        kernel_dict = load_traced_kernels(config, self.trace_workers)
+        if kernel_dict is None:
+            store = TraceStore(config.trace_path)
+            legacy_filename = os.path.join(config.trace_path,
+                                           f"trace_{config.hidden_size}_{config.tensor_parallel_size}_{config.micro_batch_size}")
+            if os.path.isfile(legacy_filename):
+                logger.warning(f"ignoring {legacy_filename}, which is not keyed by every field affecting kernel shapes; "
+                               f"register it with TraceStore.add() if it was profiled with this config")
+            log_filename = store.trace_filename(config)
             self.create_model()
             trainer = Trainer(config, self.model)
             traces = trainer.train(log_filename)
-
-        # parse traces
-        kernel_dict = self.parse_traces(traces)
+            store.add(config)
+            kernel_dict = self.parse_traces(traces)
+            keep_kernels(log_filename, kernel_dict)
 
         return kernel_dict
 
 
-    def predict(self, kernel_dict):
+    def shard_optimizer_kernels(self, kernel_dict):
+        # ZeRO/FSDP ranks only update their 1/dp shard of the parameters
+        dp = self.config.data_parallel_size
+        for function in [f for f in kernel_dict.keys() if f.startswith("WU_")]:
+            kernel_dict[function] = [(info[0] / dp,) + info[1:] for info in kernel_dict[function]]
+
+
+    def split_backward_kernels(self, kernel_dict):
+        '''
+            derive input (BwdI_*) and weight (BwdW_*) gradient passes from the
+                traced backward passes: dgrad and wgrad GEMMs of a layer have
+                the same FLOPs, so GEMM kernels are split evenly between both
+                and every other kernel computes input gradients
+        '''
+        for function in [f for f in kernel_dict.keys() if f.startswith("Bwd_")]:
+            layer_name = function[len("Bwd_"):]
+            input_grad = []
+            weight_grad = []
+            for info in kernel_dict[function]:
+                name = info[1].lower()
+                if any(gemm in name for gemm in ["gemm", "xmma", "cutlass"]):
+                    input_grad.append((info[0] / 2,) + info[1:])
+                    weight_grad.append((info[0] / 2,) + info[1:-1] + (0,))
+                else:
+                    input_grad.append(info)
+            kernel_dict[f"BwdI_{layer_name}"] = input_grad
+            kernel_dict[f"BwdW_{layer_name}"] = weight_grad
+
+
+    def predict(self, kernel_dict, engine="event"):
+        if engine in ["compact", "numpy"]:
+            # array-backed graph, TaskNode objects are never created
+            if self.keep_kernel_detail:
+                self.compiled = self.compile_graph(kernel_dict)
+            else:
+                self.compiled = self.time_topology(self.get_topology(), kernel_dict)
+            if engine == "numpy":
+                return self._predict_numpy(self.compiled)
+            return self._predict_compact(self.compiled)
+
+        self.expand_layer_nodes(kernel_dict)
+
+        # prediction (Algorithm 1 in paper)
+        if engine == "event":
+            return self._predict_event()
+        elif engine == "reference":
+            return self._predict_reference()
+        else:
+            raise ValueError(f"unknown prediction engine: {engine}")
+
+
+    def expand_layer_nodes(self, kernel_dict):
         graph = self.graph
 
         # rebuild graph
@@ -380,20 +1163,277 @@ class vTrain():
 
             graph.streams[stream] = new_nodes
 
-        # prediction (Algorithm 1 in paper)
+
+    def compile_graph(self, kernel_dict):
+        '''
+            build a CompactGraph equivalent to the graph produced by
+                expand_layer_nodes, including the children order left
+                behind by replace_node, so that predictions are bit-identical
+        '''
+        graph = self.graph
+        builder = GraphBuilder()
+        for stream in graph.streams.keys():
+            builder.create_stream(stream)
+
+        span = dict()       # layer node -> (first task, last task)
+        order = dict()      # layer node -> order of replacement
+        layer_nodes = []
+        for stream, nodes in graph.streams.items():
+            for layer_node in nodes:
+                key = id(layer_node)
+                if key in span:
+                    # comm nodes are listed in several streams
+                    builder.append_node_to_stream(span[key][0], stream)
+                    continue
+
+                nodeInfo = kernel_dict.get(layer_node.function, [])
+                if len(nodeInfo) == 0:
+                    u = builder.add_node(layer_node.stream, layer_node.duration, layer_node.gap,
+                                         layer_node.function, layer_node.is_comm_node())
+                    span[key] = (u, u)
+                else:
+                    first = len(builder)
+                    for info in nodeInfo:
+                        builder.add_node(stream, info[0], info[-1], layer_node.function)
+                    last = len(builder) - 1
+                    for u in range(first, last):
+                        builder.add_dependency(u, u+1)
+                    builder.gap[last] = layer_node.gap
+                    span[key] = (first, last)
+                    order[key] = len(order)
+                layer_nodes.append(layer_node)
+
+        # replace_node moves every replaced child to the back of its
+        # parent's child list, in the order the replacements happen
+        for layer_node in layer_nodes:
+            last = span[id(layer_node)][1]
+            for c in sorted(layer_node.child, key=lambda c: order.get(id(c), -1)):
+                builder.add_dependency(last, span[id(c)][0])
+
+        return builder.build()
+
+
+    def get_topology(self):
+        # topology of the current layer graph, shared across instances
+        topology = topology_cache.get(self.graph_key)
+        if topology is None:
+            topology = self.compile_topology()
+            topology_cache.put(self.graph_key, topology)
+        return topology
+
+
+    def compile_topology(self):
+        '''
+            compile the layer graph into a GraphTopology, i.e. its structure
+                plus what every layer node's duration is made of, so that
+                durations can be recomputed for any config of the same structure
+        '''
+        graph = self.graph
+        builder = GraphBuilder()
+        for stream in graph.streams.keys():
+            builder.create_stream(stream)
+
+        index = dict()
+        layer_nodes = []
+        rank = []
+        peer = []
+        bucket = []
+        contended = []
+        for stream, nodes in graph.streams.items():
+            for layer_node in nodes:
+                key = id(layer_node)
+                if key not in index:
+                    index[key] = builder.add_node(layer_node.stream, 0., 0., layer_node.function,
+                                                  layer_node.is_comm_node())
+                    layer_nodes.append(layer_node)
+                    rank.append(-1)
+                    peer.append(-1)
+                    bucket.append(layer_node.bucket_idx if layer_node.is_comm_node() else -1)
+                    contended.append(getattr(layer_node, "contended", None))
+                else:
+                    # comm nodes are listed in several streams
+                    builder.append_node_to_stream(index[key], stream)
+                # GPU{rank}, TP{rank}, DP{rank} and PP{rank}_{peer}
+                name, _, peer_rank = stream.partition("_")
+                prefix = name.rstrip("0123456789")
+                if prefix in ["GPU", "TP", "DP", "PP"]:
+                    rank[index[key]] = int(name[len(prefix):])
+                if prefix == "PP":
+                    peer[index[key]] = int(peer_rank)
+
+        for layer_node in layer_nodes:
+            for c in layer_node.child:
+                builder.add_dependency(index[id(layer_node)], index[id(c)])
+
+        # collective slowing down an sm_contention node
+        contended = [-1 if node is None else index[id(node)] for node in contended]
+
+        return GraphTopology(builder.build(), {"rank": np.array(rank, dtype=np.int32),
+                                               "peer": np.array(peer, dtype=np.int32),
+                                               "bucket": np.array(bucket, dtype=np.int32),
+                                               "contended": np.array(contended, dtype=np.int32)})
+
+
+    def time_topology(self, topology, kernel_dict):
+        # contracted graph of ``topology`` timed for the current config
+        return topology.retime(*self.compute_durations(topology, kernel_dict))
+
+
+    def compute_durations(self, topology, kernel_dict):
+        '''
+            durations and gaps of the layer-level nodes of ``topology``
+                for the current config
+        '''
+        config = self.config
+        graph = topology.graph
+        rank = topology.columns["rank"]
+        bucket = topology.columns["bucket"]
+
+        # layer nodes are replaced by their kernels
+        kernel_duration = np.zeros(len(graph.functions), dtype=np.float64)
+        kernel_gap = np.zeros(len(graph.functions), dtype=np.float64)
+        for i, function in enumerate(graph.functions):
+            nodeInfo = kernel_dict.get(function, [])
+            kernel_duration[i] = sum(info[0] for info in nodeInfo)
+            kernel_gap[i] = sum(info[-1] for info in nodeInfo[:-1])
+
+        duration = kernel_duration[graph.node_function]
+        gap = kernel_gap[graph.node_function]
+
+        # communication
+        if "allreduce_tp" in graph.functions:
+            tp_comm = graph.node_function == graph.functions.index("allreduce_tp")
+            duration[tp_comm] = self.compute_tp_comm_time(self.get_feature_map_size())
+        if "p2p_pp" in graph.functions:
+            pp_comm = graph.node_function == graph.functions.index("p2p_pp")
+            duration[pp_comm] = self.compute_p2p_time(self.get_feature_map_size(), rank[pp_comm],
+                                                      topology.columns["peer"][pp_comm])
+        # every collective of a kind is timed in one call
+        dp_sizes_by_rank = self.get_dp_comm_sizes_by_rank()
+        for function in ["allreduce_dp", "allgather_dp", "reducescatter_dp"]:
+            if function not in graph.functions:
+                continue
+            dp_comm = graph.node_function == graph.functions.index(function)
+            sizes = np.array([dp_sizes_by_rank[r][function][b] for r, b in zip(rank[dp_comm], bucket[dp_comm])],
+                             dtype=np.float64)
+            duration[dp_comm] = self.compute_dp_comm_time(sizes, function[:-len("_dp")])
+
+        if "sm_contention" in graph.functions:
+            contention = graph.node_function == graph.functions.index("sm_contention")
+            duration[contention] = config.comm_sm_contention * duration[topology.columns["contended"][contention]]
+
+        return duration, gap
+
+
+    def _predict_compact(self, compiled):
+        # event engine over the CSR arrays of a CompactGraph
+        streams = compiled.streams
+        duration = memoryview(compiled.duration)
+        gap = memoryview(compiled.gap)
+        comm = memoryview(compiled.comm)
+        node_stream = memoryview(compiled.node_stream)
+        indptr = memoryview(compiled.indptr)
+        indices = memoryview(compiled.indices)
+        ref = memoryview(compiled.indeg.copy())
+        start = memoryview(compiled.start)
+
+        P = {stream: 0. for stream in streams}
+        P_brk = {stream: {"compute": 0., "comm": 0.} for stream in streams}
+        Q = deque(u for nodes in compiled.stream_nodes for u in nodes.tolist() if ref[u] == 0)
+
+        logger.info(f"start prediction with {len(Q)} nodes (total {sum(len(n) for n in compiled.stream_nodes)} nodes)")
+
+        pop = Q.popleft
+        push = Q.append
+        while Q:
+            u = pop()
+            t = streams[node_stream[u]]
+            end = start[u] + duration[u] + gap[u]
+            if end > P[t]:
+                P[t] = end
+            if comm[u]:
+                P_brk[t]["comm"] += duration[u]
+            else:
+                P_brk[t]["compute"] += duration[u]
+
+            for i in range(indptr[u], indptr[u+1]):
+                c = indices[i]
+                if end > start[c]:
+                    start[c] = end
+                ref[c] -= 1
+                if ref[c] == 0:
+                    push(c)
+
+        return P, P_brk
+
+
+    def _predict_numpy(self, compiled):
+        makespan, compute, comm = self._solve_numpy(compiled)
+        return self._to_result(compiled.streams, makespan, compute, comm)
+
+
+    def _solve_numpy(self, compiled):
+        # level-synchronous longest-path relaxation,
+        # one np.maximum.at per topological level
+        # durations may carry a trailing scenario axis, i.e. (num_nodes, K)
+        node_order, level_ptr, edge_src, edge_dst, edge_ptr = compiled.compile_levels()
+        logger.info(f"start prediction with {len(level_ptr)-1} levels (total {len(compiled)} nodes)")
+
+        shape = compiled.duration.shape
+        start = np.zeros(shape, dtype=np.float64)
+        end = np.zeros(shape, dtype=np.float64)
+        compiled.start = start
+        for l in range(len(level_ptr)-1):
+            nodes = node_order[level_ptr[l]:level_ptr[l+1]]
+            end[nodes] = start[nodes] + compiled.duration[nodes] + compiled.gap[nodes]
+
+            src = edge_src[edge_ptr[l]:edge_ptr[l+1]]
+            dst = edge_dst[edge_ptr[l]:edge_ptr[l+1]]
+            np.maximum.at(start, dst, end[src])
+
+        stream_shape = (len(compiled.streams),) + shape[1:]
+        is_comm = compiled.comm.reshape((-1,) + (1,) * (len(shape) - 1))
+        makespan = np.zeros(stream_shape, dtype=np.float64)
+        comm = np.zeros(stream_shape, dtype=np.float64)
+        compute = np.zeros(stream_shape, dtype=np.float64)
+        np.maximum.at(makespan, compiled.node_stream, end)
+        np.add.at(comm, compiled.node_stream, compiled.duration * is_comm)
+        np.add.at(compute, compiled.node_stream, compiled.duration * ~is_comm)
+
+        return makespan, compute, comm
+
+
+    def _to_result(self, streams, makespan, compute, comm):
+        P = dict()
+        P_brk = dict()
+        for i, stream in enumerate(streams):
+            P[stream] = float(makespan[i])
+            P_brk[stream] = {"compute": float(compute[i]), "comm": float(comm[i])}
+
+        return P, P_brk
+
+
+    def _init_prediction(self):
         num_nodes = 0
-        Q = []
+        ready = []
         P = dict()
         P_brk = dict()
-        for stream, nodes in graph.streams.items():
+        for stream, nodes in self.graph.streams.items():
             P[stream] = 0.
             P_brk[stream] = {"compute": 0., "comm": 0.}
             num_nodes += len(nodes)
             for u in nodes:
                 if u.ref == 0:
-                    Q.append(u)
+                    ready.append(u)
 
-        logger.info(f"start prediction with {len(Q)} nodes (total {num_nodes} nodes)")
+        logger.info(f"start prediction with {len(ready)} nodes (total {num_nodes} nodes)")
+
+        return ready, P, P_brk
+
+
+    def _predict_reference(self):
+        # original list-based ready queue, kept for validation
+        Q, P, P_brk = self._init_prediction()
 
         while Q:
             u = Q.pop(0)
@@ -409,12 +1449,50 @@ class vTrain():
                 c.ref -= 1
                 if c.ref == 0:
                     Q.append(c)
-                    
+
+        return P, P_brk
+
+
+    def _predict_event(self):
+        # same visiting order as the reference engine, but every node and
+        # edge is touched exactly once (O(V+E)), so results are bit-identical
+        ready, P, P_brk = self._init_prediction()
+        Q = deque(ready)
+        pop = Q.popleft
+        push = Q.append
+
+        while Q:
+            u = pop()
+            t = u.stream
+            end = u.start + u.duration + u.gap
+            if end > P[t]:
+                P[t] = end
+            if u.is_comm_node():
+                P_brk[t]["comm"] += u.duration
+            else:
+                P_brk[t]["compute"] += u.duration
+
+            for c in u.child:
+                if end > c.start:
+                    c.start = end
+                c.ref -= 1
+                if c.ref == 0:
+                    push(c)
+
         return P, P_brk
 
     
-    def compute_bucket_assignment(self):
+    def compute_bucket_assignment(self, rank):
+        '''
+            assign the gradients of pipeline rank ``rank`` to DDP buckets in
+                reverse layer order, the first bucket is capped at 1MB and
+                the others at ddp_bucket_size MB (25MB by default)
+            returns the size of every bucket and the layer of every gradient
+                in it, i.e. bucket_indices[i][-1] is the layer whose backward
+                completes bucket i
+        '''
         layers = self.layers
+        ddp_bucket_size = self.config.ddp_bucket_size or 25
 
         size = 0
         bucket = []
@@ -422,7 +1500,10 @@ class vTrain():
         bucket_sizes = []
         bucket_size_limit = 1024 * 1024
 
-        for layer_num, (layer_name, _) in reversed(list(enumerate(layers))):
+        for layer_num in reversed(self.get_layer_idx_by_rank()[rank]):
+            layer_name, requires_grad = layers[layer_num]
+            if not requires_grad:
+                continue
             for p in reversed(self.model_params[layer_name]):
                 bucket.append(layer_num)
                 size += p.numel() * p.element_size()
@@ -432,7 +1513,7 @@ class vTrain():
                     bucket_sizes.append(size)
                     size = 0
                     bucket = []
-                    bucket_size_limit = self.bucket_size_limit
+                    bucket_size_limit = ddp_bucket_size * 1024 * 1024
 
         if size > 0:
             bucket_indices.append(bucket)
@@ -446,53 +1527,7 @@ class vTrain():
             self.cbid_table = dict()
             self.get_cbid_table()
 
-        cid2func = dict()
-        func2node = dict()
-        prevFunc = None
-        func = "NONE"
-        for trace in traces:
-            info = trace.strip().split(',')
-            type = info[2]
-            if type == "TIMESTAMP":
-                msg = info[-1].strip('"')
-                layer_num = msg.strip().split()[-1]
-                if "forward start" in msg:
-                    func = f"Fwd_{layer_num}"
-                elif "backward start" in msg:
-                    func = f"Bwd_{layer_num}"
-                elif "WU start" in msg:
-                    func = f"WU_{layer_num}"
-                elif "end" in msg:
-                    func = "NONE"
-                
-                continue
-
-            if type == "RUNTIME" or type == "DRIVER":
-                cid = int(info[-1])
-                cid2func[cid] = func
-
-            if type == "KERNEL":
-                start = int(info[0])
-                duration = int(info[1])
-                name = info[3].strip('"')
-                cid = int(info[-1])
-
-                if prevFunc and func2node[prevFunc]:
-                    prev_task = func2node[prevFunc][-1]
-                    func2node[prevFunc][-1] = prev_task[:-1] + (start - prev_task[-2] - prev_task[0],)
-
-                # duration = int(duration / 2.496)
-                # duration = int(duration * 0.7)
-                nodeInfo = (duration, name, None, cid, start, 0)
-
-                corrFunc = cid2func[cid]
-                if corrFunc not in func2node.keys():
-                    func2node[corrFunc] = []
-                func2node[corrFunc].append(nodeInfo)
-
-                prevFunc = corrFunc
-        
-        return func2node
+        return parse_trace(traces)
 
 
     def get_cbid_table(self):
@@ -516,51 +1551,67 @@ class vTrain():
 
 
     def get_allreduce_LUT(self):
+        # LUTs are parsed once per process and shared across instances
         config = self.config
+        return load_allreduce_LUTs(os.path.join(config.trace_path, config.gpu_name.lower()))
 
-        gpu_name = config.gpu_name.lower()
-        base_dir = os.path.join(config.trace_path, gpu_name)
-        lut_filenames = [file for file in os.listdir(base_dir) if file.endswith("_LUT")]
-        allreduce_LUT = dict()
-
-        for filename in lut_filenames:
-            num_gpus = int(filename.split("_")[1][3:])
-            allreduce_LUT[num_gpus] = dict()
-
-            f = open(base_dir + "/" + filename, "r")
-            lines = f.readlines()[1:]
-            f.close()
-
-            for l in lines:
-                info = l.strip().split(',')
-                size = int(info[0])//1024//1024     # megabytes
-                allreduce_LUT[num_gpus][size] = {
-                    "time": int(info[-2]),
-                    "busbw": float(info[-1])
-                }
-        
-        return allreduce_LUT
 
+    def get_collective_model(self):
+        # intra-node alpha-beta fitted to the LUTs, inter-node from the config
+        config = self.config
+        if self.allreduce_LUT:
+            intra_latency, intra_bandwidth = fit_alpha_beta(self.allreduce_LUT)
+        else:
+            intra_latency, intra_bandwidth = 0., config.intra_node_bandwidth * (2 ** 30)
+        return CollectiveModel(intra_latency, intra_bandwidth,
+                               config.p2p_latency * (10 ** 3),
+                               config.inter_node_bandwidth * (2 ** 30) / 8)
+
+
+    def compute_collective_time(self, size, num_gpus, gpus_per_node, collective="allreduce", flows_per_nic=None):
+        '''
+            time in ns of ``collective`` of ``size`` bytes across ``num_gpus`` GPUs,
+                ``gpus_per_node`` of which share a node whose NICs serve
+                ``flows_per_nic`` GPUs at once (see CollectiveModel)
+            collectives within a node are read from the allreduce LUT if it
+                measured ``num_gpus``, others use the configured algorithm
+        '''
+        if gpus_per_node >= num_gpus and num_gpus in self.allreduce_LUT.keys() and collective != "alltoall":
+            t = self.allreduce_LUT[num_gpus](size)
+            # all-gather and reduce-scatter are the two halves of a ring allreduce
+            if collective in ["allgather", "reducescatter"]:
+                t = t / 2
+            return t if np.ndim(t) else float(t)
+
+        algorithm = (self.config.collective_algorithms or dict()).get(collective, "ring")
+        return self.collective_model(collective, algorithm, size, num_gpus, gpus_per_node, flows_per_nic)
+
+
+    def compute_tp_comm_time(self, size):
+        placement = self.placement
+        return self.compute_collective_time(size, self.config.tensor_parallel_size, placement.gpus_per_node["tp"],
+                                            "allreduce", placement.flows_per_nic["tp"])
+
+
+    def compute_p2p_time(self, size, rank, peer):
+        '''
+            alpha-beta time of sending ``size`` bytes from pipeline rank ``rank``
+                to ``peer``, either over NVLink or sharing the node's NICs with
+                the other GPUs of the stage sending across nodes at once
+        '''
+        config = self.config
+        flows = np.vectorize(self.placement.link_flows, otypes=[np.int64])(rank, peer)
+        bandwidth = np.where(flows == 0, config.intra_node_bandwidth * (2 ** 30),
+                             config.inter_node_bandwidth * (2 ** 30) / 8 / np.maximum(flows, 1))    # B/s
 
-    def compute_comm_time(self, size, num_gpus):
-        if num_gpus not in self.allreduce_LUT.keys():
-            # if there are more than 8 GPUs, latency is estimated by BW
-            # assuming a 16-GPU node with all-to-all NVSwitch topology such as HGX
-            t = size / (self.config.intra_node_bandwidth * (2 ** 30)) * (2*(num_gpus-1)/num_gpus) # second
-            t = t * (10 ** 9)  # nanosecond
+        t = config.p2p_latency * (10 ** 3) + size / bandwidth * (10 ** 9)  # nanosecond
+        return t if np.ndim(t) else float(t)
 
-        else:
-            # read from allreduce latency LUT
-            size_mb = round(size / 1024 / 1024)
-            if size_mb not in self.allreduce_LUT[num_gpus].keys():
-                bw = self.allreduce_LUT[num_gpus][1024]['busbw'] # GB/s
-                bw = bw * 1024 # MB/s
-                t = size_mb / bw # s
-                t = t * (10 ** 9) # ns
-            else:
-                t = self.allreduce_LUT[num_gpus][size_mb]['time']
-        
-        return t
+
+    def compute_dp_comm_time(self, size, collective="allreduce"):
+        placement = self.placement
+        return self.compute_collective_time(size, self.config.data_parallel_size, placement.gpus_per_node["dp"],
+                                            collective, placement.flows_per_nic["dp"])
 
 
     def replace_node(self, old, old_idx, new):
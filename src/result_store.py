@@ -0,0 +1,115 @@
+'''
+    persistent store of predicted results, so that sweeps only simulate
+        configs which are new or whose inputs changed
+    a result is keyed by the hash of
+        - every vTrainConfig field except trace_path and hbm_capacity,
+        - the prediction engine,
+        - the digest of the kernel trace and of the allreduce LUTs and
+        - the simulator version, the digest of the simulator sources
+    the store is an SQLite database, which may be shared by processes
+'''
+from .config import vTrainConfig
+from .trace_store import TraceStore
+
+import os
+import glob
+import json
+import time
+import sqlite3
+import hashlib
+
+
+# simulator sources whose changes invalidate stored results
+simulator_sources = ["collective.py", "config.py", "graph.py", "placement.py", "predictor.py",
+                     "schedule.py", "trace_parser.py"]
+
+# digests of files of this process, by (filename, size, mtime)
+_file_digests = dict()
+
+
+def file_digest(filenames):
+    hash = hashlib.sha256()
+    for filename in filenames:
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        if key not in _file_digests:
+            digest = hashlib.sha256()
+            with open(filename, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            _file_digests[key] = digest.hexdigest()
+        hash.update(_file_digests[key].encode())
+    return hash.hexdigest()
+
+
+def simulator_version():
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    return file_digest([os.path.join(src_dir, source) for source in simulator_sources])[:16]
+
+
+def lut_digest(config: vTrainConfig):
+    lut_dir = os.path.join(config.trace_path, config.gpu_name.lower())
+    return file_digest(sorted(glob.glob(os.path.join(lut_dir, "*_LUT"))))
+
+
+class ResultStore():
+    '''
+        results of the SQLite database ``path``
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                "key TEXT PRIMARY KEY, version TEXT, config TEXT, engine TEXT, "
+                                "iteration_time REAL, bubble_fraction REAL, P TEXT, P_brk TEXT, "
+                                "elapsed REAL, created REAL)")
+        self.connection.commit()
+
+    def key(self, config: vTrainConfig, engine):
+        '''
+            hash of the inputs of a prediction, None if the config is not traced yet
+        '''
+        trace_filename = TraceStore(config.trace_path).lookup(config)
+        if trace_filename is None:
+            return None
+
+        fields = {field: value for field, value in config.__dict__.items()
+                    if field not in ["trace_path", "hbm_capacity"]}
+        canonical = json.dumps({"config": fields,
+                                "engine": engine,
+                                "trace": file_digest([trace_filename]),
+                                "lut": lut_digest(config),
+                                "version": simulator_version()}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key):
+        '''
+            stored result of ``key`` as a dict, or None
+        '''
+        row = self.connection.execute("SELECT iteration_time, bubble_fraction, P, P_brk, elapsed, created "
+                                      "FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        iteration_time, bubble_fraction, P, P_brk, elapsed, created = row
+        return {"iteration_time": iteration_time,
+                "bubble_fraction": bubble_fraction,
+                "P": json.loads(P),
+                "P_brk": json.loads(P_brk),
+                "elapsed": elapsed,
+                "created": created}
+
+    def put(self, key, config: vTrainConfig, engine, result, breakdown, bubble_fraction, elapsed):
+        P = {stream: float(t) for stream, t in result.items()}
+        P_brk = {stream: {k: float(v) for k, v in brk.items()} for stream, brk in breakdown.items()}
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key, simulator_version(), json.dumps(config.__dict__), engine,
+                                     max(P.values()), float(bubble_fraction), json.dumps(P), json.dumps(P_brk),
+                                     elapsed, time.time()))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,174 @@
+'''
+    pipeline schedules, i.e. the order in which every pipeline rank runs
+        the passes of the microbatches on its stages
+    a pass is a tuple (kind, microbatch_idx, chunk) where kind is
+        "F" (forward), "B" (backward, or input gradient only if the schedule
+        splits the backward pass) or "W" (weight gradient)
+    rank ``r`` holds the stages ``chunk * pp + r`` for every chunk, so that
+        a microbatch visits all ranks once per chunk
+'''
+
+
+class PipelineSchedule():
+    '''
+        base class of pipeline schedules, subclasses define rank_passes()
+        and are registered in ``pipeline_schedules``
+    '''
+    # backward passes are split into input (B) and weight (W) gradients
+    split_backward = False
+
+    def __init__(self, pp, num_microbatch, num_chunks=1):
+        self.pp = pp
+        self.num_microbatch = num_microbatch
+        self.num_chunks = num_chunks
+
+    def num_stages(self):
+        return self.pp * self.num_chunks
+
+    def stage(self, rank, chunk):
+        return chunk * self.pp + rank
+
+    def rank_passes(self, rank):
+        raise NotImplementedError
+
+    def dependency(self, kind, microbatch_idx, stage):
+        # pass (on another stage) which has to precede the given one
+        if kind == "F":
+            return ("F", microbatch_idx, stage - 1) if stage > 0 else None
+        if kind == "B":
+            if stage == self.num_stages() - 1:
+                return ("F", microbatch_idx, stage)
+            return ("B", microbatch_idx, stage + 1)
+        return ("B", microbatch_idx, stage)
+
+    def order(self):
+        '''
+            yield (rank, kind, microbatch_idx, chunk) for the passes of all
+                ranks in a topological order, i.e. a pass comes after the
+                passes of its own rank scheduled before it and after the pass
+                of the previous stage it depends on
+        '''
+        passes = [self.rank_passes(rank) for rank in range(self.pp)]
+        pointer = [0] * self.pp
+        done = set()
+
+        remaining = sum(len(p) for p in passes)
+        while remaining > 0:
+            progress = False
+            for rank in range(self.pp):
+                while pointer[rank] < len(passes[rank]):
+                    kind, microbatch_idx, chunk = passes[rank][pointer[rank]]
+                    stage = self.stage(rank, chunk)
+                    dep = self.dependency(kind, microbatch_idx, stage)
+                    if dep is not None and dep not in done:
+                        break
+
+                    yield rank, kind, microbatch_idx, chunk
+                    done.add((kind, microbatch_idx, stage))
+                    pointer[rank] += 1
+                    remaining -= 1
+                    progress = True
+
+            if not progress:
+                raise ValueError(f"{type(self).__name__} - pipeline schedule deadlocks")
+
+
+class GPipeSchedule(PipelineSchedule):
+    '''
+        all forward passes, then all backward passes
+    '''
+    def rank_passes(self, rank):
+        return [("F", i, 0) for i in range(self.num_microbatch)] + \
+                [("B", i, 0) for i in range(self.num_microbatch)]
+
+
+class OneFOneBSchedule(PipelineSchedule):
+    '''
+        non-interleaved 1F1B (PipeDream-Flush): pp - rank - 1 warmup forward
+            passes, then alternating forward and backward passes
+    '''
+    def rank_passes(self, rank):
+        num_warmup = min(self.pp - rank - 1, self.num_microbatch)
+
+        passes = [("F", i, 0) for i in range(num_warmup)]
+        for i in range(self.num_microbatch - num_warmup):
+            passes.append(("F", num_warmup + i, 0))
+            passes.append(("B", i, 0))
+        for i in range(self.num_microbatch - num_warmup, self.num_microbatch):
+            passes.append(("B", i, 0))
+
+        return passes
+
+
+class InterleavedSchedule(PipelineSchedule):
+    '''
+        interleaved 1F1B (Megatron-LM) with ``num_chunks`` virtual stages per
+            rank, microbatches visit the chunks of a rank in groups of pp
+    '''
+    def __init__(self, pp, num_microbatch, num_chunks=1):
+        super(InterleavedSchedule, self).__init__(pp, num_microbatch, num_chunks)
+        if num_microbatch % pp != 0:
+            raise ValueError(f"interleaved schedule requires num_microbatch ({num_microbatch}) "
+                             f"to be divisible by pipeline_parallel_size ({pp})")
+
+    def virtual_pass(self, k, forward):
+        group, k_in_group = divmod(k, self.pp * self.num_chunks)
+        chunk = k_in_group // self.pp
+        if not forward:
+            chunk = self.num_chunks - chunk - 1
+        return group * self.pp + k % self.pp, chunk
+
+    def rank_passes(self, rank):
+        total = self.num_microbatch * self.num_chunks
+        if self.num_microbatch == self.pp:
+            num_warmup = total
+        else:
+            num_warmup = min((self.pp - rank - 1) * 2 + (self.num_chunks - 1) * self.pp, total)
+
+        passes = [("F", *self.virtual_pass(k, True)) for k in range(num_warmup)]
+        for k in range(total - num_warmup):
+            passes.append(("F", *self.virtual_pass(num_warmup + k, True)))
+            passes.append(("B", *self.virtual_pass(k, False)))
+        for k in range(total - num_warmup, total):
+            passes.append(("B", *self.virtual_pass(k, False)))
+
+        return passes
+
+
+class ZeroBubbleSchedule(OneFOneBSchedule):
+    '''
+        ZB-H1 (Qi et al., Zero Bubble Pipeline Parallelism): 1F1B with the
+            backward pass split into B and W, where rank ``r`` defers up to
+            ``r`` W passes to fill the cooldown bubbles
+    '''
+    split_backward = True
+
+    def rank_passes(self, rank):
+        passes = []
+        deferred = []
+        for pass_ in super(ZeroBubbleSchedule, self).rank_passes(rank):
+            passes.append(pass_)
+            if pass_[0] != "B":
+                continue
+            deferred.append(pass_)
+            while len(deferred) > rank:
+                _, microbatch_idx, chunk = deferred.pop(0)
+                passes.append(("W", microbatch_idx, chunk))
+        passes += [("W", microbatch_idx, chunk) for _, microbatch_idx, chunk in deferred]
+
+        return passes
+
+
+pipeline_schedules = {
+    "gpipe": GPipeSchedule,
+    "1f1b": OneFOneBSchedule,
+    "interleaved": InterleavedSchedule,
+    "zero_bubble": ZeroBubbleSchedule,
+}
+
+
+def get_schedule(name, pp, num_microbatch, num_chunks=1):
+    if name not in pipeline_schedules:
+        raise ValueError(f"unknown pipeline scheduling: {name} "
+                         f"(one of {', '.join(pipeline_schedules.keys())})")
+    return pipeline_schedules[name](pp, num_microbatch, num_chunks)
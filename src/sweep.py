@@ -0,0 +1,231 @@
+'''
+    design-space sweep: predict many configs on a pool of worker processes
+    the parent loads the allreduce LUTs and parses the kernel traces of all
+        configs once, then forks the workers, which inherit both as
+        copy-on-write memory instead of loading them per config
+    configs are config files or the points of a SweepSpec, expanded lazily
+        and handed to the workers by index in chunks
+    results are appended to a JSON lines file as workers finish, one line
+        per config (in completion order)
+'''
+from .predictor import vTrain, load_traced_kernels
+from .config import load_configs
+from .sweep_spec import SweepSpec
+from .trace_store import trace_key
+from .result_store import ResultStore
+
+import os
+import gc
+import sys
+import json
+import time
+import types
+import logging
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import argparse
+
+logger = logging.getLogger()
+
+
+# points of the sweep, [(name, config)] or a SweepSpec, set in the parent before forking
+_points = []
+# ResultStore of this worker
+_result_store = None
+
+
+def preload(points, shard=0, num_shards=1):
+    '''
+        load the LUTs and kernel traces of the ``shard``-th of ``num_shards``
+            interleaved shards of ``points`` into this process, returns the
+            number of traces
+    '''
+    if isinstance(points, SweepSpec):
+        # only the traced ones, the product of the trace fields may include
+        # combinations no valid point has
+        traces = [types.SimpleNamespace(**fields) for fields in points.trace_points(shard, num_shards)]
+        return sum(load_traced_kernels(config) is not None for config in traces)
+
+    traces = dict()
+    for _, config in points[shard::num_shards]:
+        traces.setdefault((config.trace_path, trace_key(config)), config)
+    for config in traces.values():
+        vTrain(config).load_kernels()
+    return len(traces)
+
+
+def run(index, engine):
+    try:
+        name, config = _points[index]
+    except (AssertionError, TypeError, ValueError) as e:
+        # invalid points of a SweepSpec
+        return {"config": _points.name(index), "error": str(e)}
+    except Exception as e:
+        return {"config": _points.name(index), "error": f"{type(e).__name__}: {e}"}
+
+    start = time.perf_counter()
+    try:
+        # the memory model builds the pipeline schedule, which may reject the config
+        sim = vTrain(config)
+        if not sim.fits_in_memory():
+            return {"config": name,
+                    "error": f"out of memory, {sim.get_peak_memory() / (2 ** 30):.1f} GB "
+                             f"exceeds hbm_capacity of {config.hbm_capacity} GB",
+                    "memory": sim.get_memory_by_rank()}
+        key = _result_store.key(config, engine) if _result_store is not None else None
+        stored = _result_store.get(key) if key is not None else None
+        if stored is not None:
+            return {"config": name, **stored, "stored": True}
+
+        result, breakdown = sim(engine=engine)
+        elapsed = time.perf_counter() - start
+
+        if _result_store is not None:
+            _result_store.put(key or _result_store.key(config, engine), config, engine, result, breakdown,
+                              sim.bubble_fraction, elapsed)
+    except (AssertionError, ValueError) as e:
+        return {"config": name, "error": str(e)}
+    except Exception as e:
+        # a config the simulator fails on is recorded, the sweep goes on
+        return {"config": name, "error": f"{type(e).__name__}: {e}"}
+    return {"config": name,
+            "iteration_time": max(result.values()),
+            "bubble_fraction": sim.bubble_fraction,
+            "P": result,
+            "P_brk": breakdown,
+            "elapsed": elapsed}
+
+
+def run_chunk(indices, engine):
+    return [run(index, engine) for index in indices]
+
+
+def init_worker(result_store_path):
+    global _result_store
+    logger.setLevel(logging.WARNING)
+    # SQLite connections are not shared across processes
+    if result_store_path is not None:
+        _result_store = ResultStore(result_store_path)
+
+
+def sweep(points, output, num_workers=None, engine="numpy", result_store=None,
+          shard=0, num_shards=1, chunk_size=16):
+    '''
+        predict ``points`` ([(name, config)] or a SweepSpec) on ``num_workers``
+            processes (default: one per CPU), appending one JSON line per
+            point to the file ``output``
+        points are expanded lazily, the ``shard``-th of ``num_shards``
+            interleaved shards only, and handed to the workers
+            ``chunk_size`` at a time with a bounded number in flight
+        points whose result is in ``result_store`` are not simulated again,
+            new results are added to it; points exceeding their hbm_capacity
+            are rejected without simulation
+        returns the number of points predicted per second
+    '''
+    global _points
+    _points = points if isinstance(points, SweepSpec) else list(points)
+
+    start = time.perf_counter()
+    num_traces = preload(_points, shard, num_shards)
+    logger.info(f"loaded {num_traces} traces in {time.perf_counter() - start:.2f}s")
+
+    if isinstance(_points, SweepSpec):
+        indices = _points.indices(shard, num_shards)
+    else:
+        indices = iter(range(shard, len(_points), num_shards))
+    chunks = iter(lambda: list(itertools.islice(indices, chunk_size)), [])
+
+    # keep the inherited objects out of the collector, which would
+    # otherwise touch (and copy) their pages in every worker
+    gc.freeze()
+
+    start = time.perf_counter()
+    done = 0
+    num_errors = 0
+    num_stored = 0
+    num_rejected = 0
+    result_store_path = result_store.path if result_store is not None else None
+    max_pending = 4 * (num_workers or os.cpu_count())
+    with open(output, "a") as f:
+        # fork to share the loaded LUTs and traces with the workers
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                 initializer=init_worker, initargs=(result_store_path,)) as pool:
+            pending = set()
+            while True:
+                # a bounded number of chunks in flight, the points are never all expanded
+                for chunk in itertools.islice(chunks, max_pending - len(pending)):
+                    pending.add(pool.submit(run_chunk, chunk, engine))
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for result in future.result():
+                        f.write(json.dumps(result) + "\n")
+                        done += 1
+                        if "memory" in result:
+                            num_rejected += 1
+                        elif "error" in result:
+                            num_errors += 1
+                            logger.warning(f"{result['config']}: {result['error']}")
+                        elif result.get("stored"):
+                            num_stored += 1
+                        if done % 100 == 0:
+                            logger.info(f"{done} points, {done / (time.perf_counter() - start):.1f} points/s")
+                f.flush()
+
+    gc.unfreeze()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"predicted {done - num_errors - num_rejected} points ({num_stored} from the result store, "
+                f"{num_rejected} rejected out of memory, {num_errors} failed) in {elapsed:.2f}s, "
+                f"{done / elapsed:.1f} points/s")
+    return done / elapsed
+
+
+def main(args):
+    if args.spec is not None:
+        points = SweepSpec.load_from_file(args.spec)
+        if args.hbm_capacity is not None:
+            points.base["hbm_capacity"] = args.hbm_capacity
+    else:
+        points = list(load_configs(args.configs))
+        if not points:
+            logger.error(f"no configs found in {' '.join(args.configs)}")
+            sys.exit(1)
+        if args.hbm_capacity is not None:
+            for _, config in points:
+                config.hbm_capacity = args.hbm_capacity
+    result_store = ResultStore(args.store) if args.store is not None else None
+    sweep(points, args.output, args.workers, args.engine, result_store,
+          args.shard, args.num_shards, args.chunk_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict a sweep of configs in parallel")
+    parser.add_argument("configs", type=str, nargs="*",
+                        help="config files, globs or directories")
+    parser.add_argument("--spec", type=str, default=None,
+                        help="JSON sweep specification (see src/sweep_spec.py) instead of config files")
+    parser.add_argument("-o, --output", type=str, dest="output", default="results.jsonl",
+                        help="JSON lines file the results are appended to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--engine", type=str, default="numpy",
+                        choices=["event", "reference", "compact", "numpy", "streaming"])
+    parser.add_argument("--store", type=str, default=None,
+                        help="SQLite result store, configs predicted before are not simulated again")
+    parser.add_argument("--hbm_capacity", type=float, default=None,
+                        help="GB of memory per GPU, overrides hbm_capacity of the configs")
+    parser.add_argument("--shard", type=int, default=0,
+                        help="predict only every num_shards-th config from this one, e.g. on several hosts")
+    parser.add_argument("--num_shards", type=int, default=1)
+    parser.add_argument("--chunk_size", type=int, default=16,
+                        help="configs handed to a worker at a time")
+    args = parser.parse_args()
+    if (args.spec is None) == (not args.configs):
+        parser.error("either config files or --spec is required")
+
+    main(args)
@@ -0,0 +1,220 @@
+'''
+    declarative sweep specifications, expanded lazily into configs
+    a spec is a JSON file of
+        - "base": a config file or the fields shared by every point,
+        - "fields": values of each swept vTrainConfig field, a list or a
+            range {"start", "stop", "step"} or {"start", "stop", "factor"}
+            (stop included) and
+        - "constraints": Python expressions over the config fields which
+            every point must satisfy, e.g.
+            "num_layers % pipeline_parallel_size == 0"
+    points are the cartesian product of the swept fields, numbered in
+        itertools.product order; a point is decoded from its index, checked
+        against the constraints on plain values and only then built into a
+        vTrainConfig, so that neither the product nor the configs are ever
+        materialized and no file is read per point
+'''
+from .config import vTrainConfig
+from .trace_store import trace_fields, trace_key
+
+import json
+import types
+import inspect
+import itertools
+
+import argparse
+
+
+# builtins available to the constraints
+constraint_builtins = {"abs": abs, "all": all, "any": any, "len": len, "max": max, "min": min}
+
+# fields of vTrainConfig and their defaults
+config_parameters = list(inspect.signature(vTrainConfig.__init__).parameters.values())[1:]
+config_fields = [parameter.name for parameter in config_parameters]
+config_defaults = {parameter.name: parameter.default for parameter in config_parameters
+                   if parameter.default is not inspect.Parameter.empty}
+
+# fields some trace fields are derived from, see vTrainConfig.derive_sizes()
+size_fields = ["num_gpus", "tensor_parallel_size", "data_parallel_size", "pipeline_parallel_size",
+               "global_batch_size", "micro_batch_size"]
+
+
+def expand_values(field, values):
+    if isinstance(values, list):
+        if not values:
+            raise ValueError(f"no values of {field}")
+        return values
+    if not isinstance(values, dict) or not {"start", "stop"} <= values.keys() or \
+            not values.keys() <= {"start", "stop", "step", "factor"} or {"step", "factor"} <= values.keys():
+        raise ValueError(f"values of {field} must be a list or a range "
+                         f"{{'start', 'stop', 'step'}} or {{'start', 'stop', 'factor'}}")
+
+    start, stop = values["start"], values["stop"]
+    if "factor" in values:
+        assert values["factor"] > 1 and start > 0, f"range of {field} must grow"
+        expanded = []
+        while start <= stop:
+            expanded.append(start)
+            start *= values["factor"]
+        return expanded
+    step = values.get("step", 1)
+    assert step > 0, f"range of {field} must grow"
+    return [start + i * step for i in range(int((stop - start) // step) + 1)]
+
+
+class SweepSpec():
+    '''
+        points of a sweep, ``base`` config fields with ``fields`` {field: values}
+            swept and ``constraints`` (expressions) satisfied
+    '''
+    def __init__(self, base, fields, constraints=()):
+        unknown = [field for field in list(base) + list(fields) if field not in config_fields]
+        if unknown:
+            raise ValueError(f"unknown config fields {', '.join(unknown)}")
+
+        self.base = dict(base)
+        self.fields = {field: expand_values(field, values) for field, values in fields.items()}
+        self.constraints = list(constraints)
+        # compiled once, evaluated per point
+        self.compiled = [compile(constraint, f"<constraint {constraint}>", "eval") for constraint in self.constraints]
+
+        self.num_points = 1
+        for values in self.fields.values():
+            self.num_points *= len(values)
+
+
+    @classmethod
+    def load_from_file(cls, file_path: str):
+        with open(file_path, "r") as f:
+            spec = json.load(f)
+        base = spec.get("base", dict())
+        if isinstance(base, str):
+            with open(base, "r") as f:
+                base = json.load(f)
+        return cls(base, spec.get("fields", dict()), spec.get("constraints", []))
+
+
+    def __len__(self):
+        # points before the constraints
+        return self.num_points
+
+
+    def point(self, index):
+        '''
+            swept field values of the ``index``-th point, the last field
+                varying fastest
+        '''
+        if not 0 <= index < self.num_points:
+            raise IndexError(f"point {index} out of {self.num_points}")
+        point = dict()
+        for field, values in reversed(self.fields.items()):
+            index, digit = divmod(index, len(values))
+            point[field] = values[digit]
+        return {field: point[field] for field in self.fields}
+
+
+    def accepts(self, point):
+        namespace = {**config_defaults, **self.base, **point}
+        return all(eval(code, {"__builtins__": constraint_builtins}, namespace) for code in self.compiled)
+
+
+    def name(self, index):
+        return ", ".join(f"{field}={value}" for field, value in self.point(index).items())
+
+
+    def indices(self, shard=0, num_shards=1):
+        '''
+            indices of the points satisfying the constraints, of the ``shard``-th
+                of ``num_shards`` interleaved shards
+        '''
+        assert 0 <= shard < num_shards, "shard must be in [0, num_shards)"
+        for index in range(shard, self.num_points, num_shards):
+            if self.accepts(self.point(index)):
+                yield index
+
+
+    def __getitem__(self, index):
+        '''
+            (name, config) of the ``index``-th point, raises AssertionError
+                if the config is invalid
+        '''
+        return self.name(index), vTrainConfig(**{**self.base, **self.point(index)})
+
+
+    def __iter__(self):
+        # (name, config) of the valid points satisfying the constraints
+        for index in self.indices():
+            try:
+                yield self[index]
+            except AssertionError:
+                continue
+
+
+    def trace_points(self, shard=0, num_shards=1):
+        '''
+            distinct trace fields (and trace_path) of the points of the ``shard``-th
+                of ``num_shards`` shards satisfying the constraints, from the
+                product of the swept fields they are derived from only
+        '''
+        assert 0 <= shard < num_shards, "shard must be in [0, num_shards)"
+        inputs = trace_fields + size_fields + ["trace_path"]
+        swept = [field for field in self.fields if field in inputs]
+        others = [field for field in self.fields if field not in inputs]
+        # weight of every field's digit in the point index
+        weights = dict()
+        weight = 1
+        for field, values in reversed(self.fields.items()):
+            weights[field] = weight
+            weight *= len(values)
+
+        seen = set()
+        for digits in itertools.product(*(range(len(self.fields[field])) for field in swept)):
+            point = {field: self.fields[field][digit] for field, digit in zip(swept, digits)}
+            # derived as the configs of the points derive them
+            config = types.SimpleNamespace(**{**config_defaults, **self.base, **point})
+            try:
+                vTrainConfig.derive_sizes(config)
+            except (AssertionError, TypeError, ZeroDivisionError):
+                continue
+            key = (config.trace_path, trace_key(config))
+            if key in seen:
+                continue
+
+            # kept if any point of the shard with these values satisfies the constraints
+            offset = sum(digit * weights[field] for field, digit in zip(swept, digits))
+            for other in itertools.product(*(range(len(self.fields[field])) for field in others)):
+                index = offset + sum(digit * weights[field] for field, digit in zip(others, other))
+                if index % num_shards != shard:
+                    continue
+                if self.accepts({**point, **{field: self.fields[field][digit] for field, digit in zip(others, other)}}):
+                    seen.add(key)
+                    yield {field: getattr(config, field) for field in trace_fields + ["trace_path"]}
+                    break
+
+
+def main(args):
+    spec = SweepSpec.load_from_file(args.spec)
+    num_valid = 0
+    for index in spec.indices(args.shard, args.num_shards):
+        try:
+            name, _ = spec[index]
+        except AssertionError as e:
+            if args.verbose:
+                print(f"{index} [invalid] {spec.name(index)}: {e}")
+            continue
+        num_valid += 1
+        if args.verbose:
+            print(f"{index} {name}")
+    print(f"{len(spec)} points, {num_valid} valid configs in shard {args.shard} of {args.num_shards}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expand a sweep specification")
+    parser.add_argument("spec", type=str, help="JSON sweep specification")
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--num_shards", type=int, default=1)
+    parser.add_argument("-v, --verbose", action="store_true", dest="verbose",
+                        help="print every point")
+    args = parser.parse_args()
+
+    main(args)
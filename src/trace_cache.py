@@ -0,0 +1,109 @@
+'''
+    binary columnar cache of parsed kernel traces
+    a cache file holds a JSON header followed by one array per column,
+        kernels are grouped by function so that the kernels of function
+        ``f`` are rows ``indptr[f]:indptr[f+1]``
+    the header records the size and modification time of the source trace,
+        a cache whose source changed is ignored (and rewritten by profile())
+'''
+import numpy as np
+
+import os
+import json
+import struct
+from itertools import repeat
+
+
+MAGIC = b"VTRC"
+VERSION = 1
+ALIGN = 8
+
+# columns of the kernels, (duration, name, stream, cid, start, gap) tuples in kernel_dict
+columns = [("duration", np.int64), ("name_id", np.int32), ("cid", np.int64),
+           ("start", np.int64), ("gap", np.int64)]
+
+
+def trace_cache_path(trace_filename):
+    return f"{trace_filename}.vtc"
+
+
+def source_stamp(trace_filename):
+    stat = os.stat(trace_filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def save_trace_cache(trace_filename, kernel_dict):
+    '''
+        write the kernel_dict parsed from ``trace_filename`` next to it,
+            atomically so that concurrent workers never read a partial file
+    '''
+    functions = list(kernel_dict.keys())
+    names = dict()
+    rows = [info for function in functions for info in kernel_dict[function]]
+    data = {"duration": [info[0] for info in rows],
+            "name_id": [names.setdefault(info[1], len(names)) for info in rows],
+            "cid": [info[3] for info in rows],
+            "start": [info[4] for info in rows],
+            "gap": [info[-1] for info in rows]}
+    indptr = np.cumsum([0] + [len(kernel_dict[function]) for function in functions], dtype=np.int64)
+
+    arrays = [("indptr", indptr)] + [(column, np.asarray(data[column], dtype=dtype)) for column, dtype in columns]
+    offset = 0
+    layout = dict()
+    for column, array in arrays:
+        layout[column] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({"version": VERSION,
+                         "source": source_stamp(trace_filename),
+                         "functions": functions,
+                         "names": list(names.keys()),
+                         "columns": layout}).encode()
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+    cache_filename = trace_cache_path(trace_filename)
+    tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for _, array in arrays:
+            f.write(array.tobytes())
+            f.write(b"\0" * (-array.nbytes % ALIGN))
+    os.replace(tmp_filename, cache_filename)
+
+
+def load_trace_cache(trace_filename):
+    '''
+        kernel_dict of ``trace_filename`` from its memory-mapped cache,
+            or None if there is no up-to-date cache
+    '''
+    cache_filename = trace_cache_path(trace_filename)
+    try:
+        with open(cache_filename, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            header_size, = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header.get("version") != VERSION or header.get("source") != source_stamp(trace_filename):
+        return None
+
+    buffer = np.memmap(cache_filename, dtype=np.uint8, mode="r")
+    start = len(MAGIC) + 8 + header_size
+    data = dict()
+    for column, (dtype, offset, length) in header["columns"].items():
+        data[column] = np.frombuffer(buffer, dtype=dtype, count=length, offset=start + offset)
+
+    names = np.array(header["names"], dtype=object)
+    indptr = data["indptr"].tolist()
+    kernel_dict = dict()
+    for f, function in enumerate(header["functions"]):
+        rows = slice(indptr[f], indptr[f+1])
+        kernel_dict[function] = list(zip(data["duration"][rows].tolist(),
+                                         names[data["name_id"][rows]].tolist(),
+                                         repeat(None),
+                                         data["cid"][rows].tolist(),
+                                         data["start"][rows].tolist(),
+                                         data["gap"][rows].tolist()))
+
+    return kernel_dict
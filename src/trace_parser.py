@@ -0,0 +1,157 @@
+'''
+    streaming parser of CUPTI traces into kernel_dict, as a generator pipeline
+        read (lines of a byte range) -> split (fields) -> classify (records)
+        -> correlate (kernels to the function of their launch, by cid)
+    a trace is parsed in chunks of lines, which may run in a process pool;
+        merge() then resolves what a chunk cannot know on its own: the
+        function active at its first line, launches (cids) of earlier chunks
+        and the gap after its last kernel
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def read_lines(filename, start=0, end=None):
+    '''
+        lines starting within bytes [start, end) of ``filename``
+    '''
+    with open(filename, "rb") as f:
+        if start > 0:
+            # the line across ``start`` belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode()
+
+
+def split(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line.split(',')
+
+
+def classify(records):
+    '''
+        ("function", name) when a layer starts or ends,
+            ("launch", cid) for CUDA runtime/driver API calls and
+            ("kernel", start, duration, name, cid) for GPU kernels
+    '''
+    for info in records:
+        type = info[2]
+        if type == "TIMESTAMP":
+            msg = info[-1].strip('"')
+            layer_num = msg.strip().split()[-1]
+            if "forward start" in msg:
+                yield "function", f"Fwd_{layer_num}"
+            elif "backward start" in msg:
+                yield "function", f"Bwd_{layer_num}"
+            elif "WU start" in msg:
+                yield "function", f"WU_{layer_num}"
+            elif "end" in msg:
+                yield "function", "NONE"
+
+        elif type == "RUNTIME" or type == "DRIVER":
+            yield "launch", int(info[-1])
+
+        elif type == "KERNEL":
+            yield "kernel", int(info[0]), int(info[1]), info[3].strip('"'), int(info[-1])
+
+
+class TraceChunk():
+    '''
+        kernels of a chunk of records, correlated as far as possible
+        a function of None stands for the function active before the chunk,
+            a kernel whose launch is not in the chunk has function None and is
+            correlated by merge()
+    '''
+    def __init__(self):
+        self.function = None
+        self.launches = dict()
+        self.kernels = []
+
+
+def correlate(events):
+    chunk = TraceChunk()
+    kernels = chunk.kernels
+    launches = chunk.launches
+    for event in events:
+        kind = event[0]
+        if kind == "function":
+            chunk.function = event[1]
+        elif kind == "launch":
+            launches[event[1]] = chunk.function
+        else:
+            _, start, duration, name, cid = event
+            if kernels:
+                # gap between the previous kernel and this one
+                prev = kernels[-1]
+                kernels[-1] = prev[:-1] + (start - prev[-2] - prev[2],)
+            # (launched in this chunk, function, duration, name, stream, cid, start, gap)
+            kernels.append((cid in launches, launches.get(cid), duration, name, None, cid, start, 0))
+
+    return chunk
+
+
+def parse_chunk(filename, start=0, end=None):
+    return correlate(classify(split(read_lines(filename, start, end))))
+
+
+def merge(chunks):
+    '''
+        kernel_dict of consecutive chunks, {function: [(duration, name, None, cid, start, gap)]}
+    '''
+    func2node = dict()
+    cid2func = dict()
+    function = "NONE"
+    last = None
+    for chunk in chunks:
+        for launched, func, *nodeInfo in chunk.kernels:
+            if not launched:
+                func = cid2func[nodeInfo[3]]
+            elif func is None:
+                func = function
+
+            if last is not None:
+                # gap after the last kernel of the previous chunk
+                prev = func2node[last][-1]
+                func2node[last][-1] = prev[:-1] + (nodeInfo[-2] - prev[-2] - prev[0],)
+                last = None
+            func2node.setdefault(func, []).append(tuple(nodeInfo))
+
+        if chunk.kernels:
+            last = func
+        for cid, func in chunk.launches.items():
+            cid2func[cid] = function if func is None else func
+        if chunk.function is not None:
+            function = chunk.function
+
+    return func2node
+
+
+def parse_trace(lines):
+    # parse an in-memory trace in one chunk
+    return merge([correlate(classify(split(lines)))])
+
+
+def chunk_ranges(filename, chunk_size):
+    size = os.path.getsize(filename)
+    return [(start, min(start + chunk_size, size)) for start in range(0, max(size, 1), chunk_size)]
+
+
+def parse_trace_file(filename, num_workers=1, chunk_size=64 * 1024 ** 2):
+    '''
+        kernel_dict of the trace ``filename``, parsed in chunks of
+            ``chunk_size`` bytes by ``num_workers`` processes
+    '''
+    ranges = chunk_ranges(filename, chunk_size)
+    if num_workers <= 1 or len(ranges) == 1:
+        chunks = [parse_chunk(filename, start, end) for start, end in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            chunks = list(pool.map(parse_chunk, [filename] * len(ranges), *zip(*ranges)))
+
+    return merge(chunks)
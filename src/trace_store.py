@@ -0,0 +1,134 @@
+'''
+    content-addressed store of profiled kernel traces
+    a trace is keyed by the hash of every config field that affects the
+        shapes of the profiled kernels, so that configs differing only in
+        e.g. the parallelism degrees or the network share one trace while
+        configs differing in e.g. max_length never do
+    the manifest (``manifest.json`` in the store directory) maps every key
+        to the fields it was computed from
+'''
+from .config import vTrainConfig, load_configs
+
+import os
+import json
+import hashlib
+
+import argparse
+
+
+# fields of vTrainConfig read by vTrain.create_model() and Trainer.train()
+trace_fields = ["model_arch", "gpu_name", "hidden_size", "num_attention_heads", "max_length",
+                "vocab_size", "tensor_parallel_size", "micro_batch_size"]
+
+MANIFEST = "manifest.json"
+
+
+def trace_fields_of(config: vTrainConfig):
+    fields = {field: getattr(config, field) for field in trace_fields}
+    fields["gpu_name"] = fields["gpu_name"].lower()
+    return fields
+
+
+def trace_key(config: vTrainConfig):
+    canonical = json.dumps(trace_fields_of(config), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+class TraceStore():
+    '''
+        traces of the store directory ``path``, named ``trace_{key}``
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def save_manifest(self):
+        # atomically, the manifest may be updated by concurrent profiling runs
+        filename = os.path.join(self.path, MANIFEST)
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(self.manifest, f, indent=4, sort_keys=True)
+        os.replace(tmp_filename, filename)
+
+    def trace_filename(self, config: vTrainConfig):
+        return os.path.join(self.path, f"trace_{trace_key(config)}")
+
+    def lookup(self, config: vTrainConfig):
+        '''
+            filename of the trace of ``config``, or None if it is not profiled yet
+        '''
+        key = trace_key(config)
+        if key not in self.manifest:
+            # added by another process since the manifest was loaded
+            self.manifest = self.load_manifest()
+        if key in self.manifest and os.path.isfile(self.trace_filename(config)):
+            return self.trace_filename(config)
+        return None
+
+    def add(self, config: vTrainConfig, filename=None):
+        '''
+            register the trace of ``config``, moving ``filename`` (e.g. a trace
+                profiled elsewhere) into the store if given
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        trace_filename = self.trace_filename(config)
+        if filename is not None and os.path.abspath(filename) != os.path.abspath(trace_filename):
+            os.replace(filename, trace_filename)
+
+        self.manifest = self.load_manifest()
+        self.manifest[trace_key(config)] = trace_fields_of(config)
+        self.save_manifest()
+        return trace_filename
+
+    def plan(self, configs):
+        '''
+            traces needed by ``configs``, deduplicated, as
+                {key: {"fields": ..., "configs": [config names], "profiled": bool}}
+        '''
+        plan = dict()
+        for name, config in configs:
+            key = trace_key(config)
+            if key not in plan:
+                plan[key] = {"fields": trace_fields_of(config), "configs": [],
+                             "profiled": self.lookup(config) is not None}
+            plan[key]["configs"].append(name)
+        return plan
+
+
+def main(args):
+    configs = list(load_configs(args.configs))
+    store = TraceStore(args.trace_path or configs[0][1].trace_path)
+    plan = store.plan(configs)
+
+    missing = [key for key, entry in plan.items() if not entry["profiled"]]
+    for key, entry in plan.items():
+        status = "profiled" if entry["profiled"] else "missing"
+        fields = ", ".join(f"{field}={value}" for field, value in entry["fields"].items())
+        print(f"{key} [{status}] {len(entry['configs'])} configs: {fields}")
+    print(f"{len(configs)} configs need {len(plan)} traces, {len(missing)} to be profiled")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({key: plan[key] for key in (missing if args.missing else plan)}, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profiling plan: the traces needed by a sweep of configs")
+    parser.add_argument("configs", type=str, nargs="+",
+                        help="config files, globs or directories")
+    parser.add_argument("--trace_path", type=str, default=None,
+                        help="trace store (default: trace_path of the first config)")
+    parser.add_argument("-o, --output", type=str, dest="output", default=None,
+                        help="JSON file of the plan")
+    parser.add_argument("--missing", action="store_true",
+                        help="only write the traces which are not profiled yet")
+    args = parser.parse_args()
+
+    main(args)